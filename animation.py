@@ -0,0 +1,206 @@
+"""
+动画输出：把逐帧的 BGR 图片写成 GIF 或 APNG 动画
+
+- 全部帧共用一个全局调色板，由第一帧的颜色生成（中位切分 + k-means，见 palette），
+  之后的帧通过 32×32×32 的查找表量化，调色板中的颜色精确映射到自身
+- 帧差分：每帧只写出与上一帧相比发生变化的矩形区域，画面不变的帧只延长上一帧的显示时间
+- --max_fps 丢弃过密的帧，--max_seconds 限制动画长度（GIF 本身最高 50 帧/秒）
+- 逐帧写入磁盘，内存中只保留上一帧的索引图和一个尚未写出的矩形
+
+AnimationWriter 与 cv2.VideoWriter 一样提供 write / release，可以直接替换视频写入器。
+"""
+import os
+import struct
+
+from palette import adaptive_palette, nearest
+from png_stream import ApngWriter
+from startup import lazy_import
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+ImageSequence = lazy_import("PIL.ImageSequence")
+GifImagePlugin = lazy_import("PIL.GifImagePlugin")
+
+ANIMATION_EXTENSIONS = (".gif", ".png", ".apng")
+# GIF 的延迟以 1/100 秒为单位，浏览器会把小于 2 的延迟当作 10
+GIF_MAX_FPS = 50
+# 生成调色板时在每个方向上每隔几个像素取一个样本
+_SAMPLE_STEP = 2
+# 量化查找表每个通道保留的位数
+_LUT_BITS = 5
+
+
+def is_animation(path):
+    return os.path.splitext(path)[1].lower() in ANIMATION_EXTENSIONS
+
+
+def add_animation_args(parser):
+    parser.add_argument("--max_fps", type=float, default=0,
+                        help="drop frames above this rate in GIF/APNG output (0: no limit; GIF is capped at 50)")
+    parser.add_argument("--max_seconds", type=float, default=0,
+                        help="stop GIF/APNG output after this many seconds (0: no limit)")
+    parser.add_argument("--loop", type=int, default=0, help="GIF/APNG loop count (0: forever)")
+    return parser
+
+
+def read_frames(path):
+    """逐帧读取动画图片，依次返回 (BGR 数组, 显示时长毫秒)，不会同时解码多帧"""
+    with Image.open(path) as image:
+        for frame in ImageSequence.Iterator(image):
+            duration = frame.info.get("duration") or 100
+            yield np.ascontiguousarray(np.asarray(frame.convert("RGB"))[:, :, ::-1]), duration
+
+
+def frame_count(path):
+    """图片的帧数，无法读取时返回 0"""
+    try:
+        with Image.open(path) as image:
+            return getattr(image, "n_frames", 1)
+    except Exception:
+        return 0
+
+
+class GifWriter:
+    """逐帧写入调色板索引图的 GIF 动画，接口与 png_stream.ApngWriter 相同"""
+
+    def __init__(self, path, width, height, palette, loop=0):
+        self.width = width
+        self.height = height
+        self.frames_written = 0
+        # 全局颜色表固定为 256 色
+        table = np.zeros((256, 3), dtype=np.uint8)
+        table[:len(palette)] = palette
+        self._file = open(path, "wb")
+        self._file.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0xf7, 0, 0) + table.tobytes())
+        # NETSCAPE2.0 扩展：循环次数
+        self._file.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", loop) + b"\x00")
+
+    def write_frame(self, indices, x, y, duration):
+        frame = Image.fromarray(np.ascontiguousarray(indices, dtype=np.uint8), "P")
+        # disposal 1：保留这一帧，下一帧叠加在它上面
+        for data in GifImagePlugin.getdata(frame, offset=(x, y), duration=duration, disposal=1):
+            self._file.write(data)
+        self.frames_written += 1
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            self._file.write(b";")
+        finally:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class AnimationWriter:
+    """
+    接收 BGR 帧，量化到全局调色板后只把变化的区域写入 GIF 或 APNG
+
+    fps 为默认的帧率（write 不指定显示时长时使用）；opt 提供 max_fps、max_seconds、loop
+    以及 palette_size、kmeans_iterations（见 palette）。达到 max_seconds 后 done 为真，之后的帧被忽略。
+    """
+
+    def __init__(self, path, fps, first_frame, opt):
+        height, width = first_frame.shape[:2]
+        self.frame_duration = 1000 / fps if fps > 0 else 100
+        self.max_seconds = getattr(opt, "max_seconds", 0)
+        max_fps = getattr(opt, "max_fps", 0)
+        self.gif = os.path.splitext(path)[1].lower() == ".gif"
+        if self.gif:
+            max_fps = min(max_fps or GIF_MAX_FPS, GIF_MAX_FPS)
+        self.min_interval = 1000 / max_fps if max_fps > 0 else 0
+        self.done = False
+        # 背景取左上角的颜色，调色板为 BGR 顺序
+        samples = first_frame[::_SAMPLE_STEP, ::_SAMPLE_STEP].reshape(-1, 3)
+        size = min(max(getattr(opt, "palette_size", 256), 2), 256)
+        self.palette = adaptive_palette(samples, first_frame[0, 0], size, getattr(opt, "kmeans_iterations", 4))
+        self._lut = self._build_lut(self.palette.colors)
+        rgb_palette = self.palette.colors[:, ::-1]
+        loop = getattr(opt, "loop", 0)
+        if self.gif:
+            self._writer = GifWriter(path, width, height, rgb_palette, loop)
+        else:
+            self._writer = ApngWriter(path, width, height, rgb_palette, loop)
+        self._time = 0.0
+        self._next_time = 0.0
+        self._previous = None
+        # 尚未写出的帧：(x, y, 索引图, 开始时间)，显示时长要等到下一个变化的帧才能确定
+        self._pending = None
+
+    @property
+    def frames_written(self):
+        return self._writer.frames_written
+
+    @staticmethod
+    def _build_lut(colors):
+        """每个通道取高 _LUT_BITS 位组成下标，值为该格中心最近的调色板颜色"""
+        levels = 1 << _LUT_BITS
+        shift = 8 - _LUT_BITS
+        centers = (np.arange(levels) << shift) + (1 << shift) // 2
+        grid = np.stack(np.meshgrid(centers, centers, centers, indexing="ij"), axis=-1).reshape(-1, 3)
+        lut = nearest(grid.astype(np.float32), colors.astype(np.float32)).astype(np.uint8)
+        # 调色板中的颜色（例如调色板模式输出的字符颜色和背景）映射到自身；0 号背景最后写入，优先级最高
+        keys = AnimationWriter._keys(colors)
+        lut[keys[::-1]] = np.arange(len(colors))[::-1]
+        return lut
+
+    @staticmethod
+    def _keys(pixels):
+        shift = 8 - _LUT_BITS
+        pixels = pixels.astype(np.uint16) >> shift
+        return (pixels[..., 0] << (2 * _LUT_BITS)) | (pixels[..., 1] << _LUT_BITS) | pixels[..., 2]
+
+    def write(self, frame, duration=None):
+        """写入一帧 BGR 图片，duration 为显示时长（毫秒，默认按 fps）"""
+        if self.done:
+            return
+        start = self._time
+        if self.max_seconds and start >= self.max_seconds * 1000:
+            self.done = True
+            return
+        self._time += self.frame_duration if duration is None else duration
+        if start + 1e-6 < self._next_time:
+            # 超过最大帧率：丢弃这一帧，上一帧的显示时间随之延长
+            return
+        self._next_time = start + self.min_interval
+        indices = self._lut[self._keys(frame)]
+        if self._previous is None:
+            x, y = 0, 0
+            patch = indices
+        else:
+            changed = indices != self._previous
+            rows = np.flatnonzero(changed.any(axis=1))
+            if not len(rows):
+                return
+            cols = np.flatnonzero(changed.any(axis=0))
+            x, y = int(cols[0]), int(rows[0])
+            patch = indices[y:rows[-1] + 1, x:cols[-1] + 1]
+        self._flush(start)
+        self._pending = (x, y, patch, start)
+        self._previous = indices
+
+    def release(self):
+        end = self._time
+        if self.max_seconds:
+            end = min(end, self.max_seconds * 1000)
+        try:
+            self._flush(end)
+        finally:
+            self._writer.close()
+
+    def _flush(self, end):
+        if self._pending is None:
+            return
+        x, y, patch, start = self._pending
+        if self.gif:
+            # 按累计时间取整到 1/100 秒，避免舍入误差累积
+            duration = (round(end / 10) - round(start / 10)) * 10
+        else:
+            duration = round(end) - round(start)
+        self._writer.write_frame(patch, x, y, max(duration, 10 if self.gif else 1))
+        self._pending = None
@@ -0,0 +1,97 @@
+"""
+ANSI 真彩色文本的组装：预先计算的转义序列表 + 同色字符的游程合并
+"""
+from startup import lazy_import
+
+np = lazy_import("numpy")
+
+RESET = "\033[0m"
+CURSOR_HOME = "\033[H"
+CLEAR_SCREEN = "\033[2J"
+HIDE_CURSOR = "\033[?25l"
+SHOW_CURSOR = "\033[?25h"
+
+
+class EscapeTable(dict):
+    """
+    量化颜色编号到前景色转义序列的表
+
+    每个通道按 step 量化，编号由 quantize 计算。转义序列在第一次用到某个编号时才生成并记住，
+    表的大小只取决于实际出现过的颜色，step 为 1 时也不必预先生成 1670 万个字符串。
+    """
+
+    def __init__(self, step=1):
+        super().__init__()
+        self.levels = 256 // step
+        self.values = [str(min(level * step + step // 2, 255)) for level in range(self.levels)]
+
+    def __missing__(self, code):
+        levels = self.levels
+        escape = "\033[38;2;{};{};{}m".format(self.values[code // (levels * levels)],
+                                               self.values[code // levels % levels], self.values[code % levels])
+        self[code] = escape
+        return escape
+
+
+def build_escape_table(step=1):
+    """返回量化颜色编号到前景色转义序列的表（按需生成，见 EscapeTable）"""
+    return EscapeTable(step)
+
+
+def quantize(colors, step=1):
+    """把 (..., 3) 的 RGB 颜色转换为 build_escape_table 中的编号"""
+    levels = 256 // step
+    q = np.clip(np.asarray(colors, dtype=np.int64), 0, 255) // step
+    q = np.minimum(q, levels - 1)
+    return (q[..., 0] * levels + q[..., 1]) * levels + q[..., 2]
+
+
+def colorize_rows(lines, codes, table):
+    """
+    为每一行文字加上颜色
+
+    lines 为每行的字符串，codes 为 (rows, cols) 的颜色编号，相邻同色字符只输出一次转义序列。
+    返回带颜色的行（每行以 RESET 结尾，不含换行符）。
+    """
+    num_cols = codes.shape[1]
+    result = []
+    for line, row_codes in zip(lines, codes):
+        starts = np.flatnonzero(np.r_[True, row_codes[1:] != row_codes[:-1]])
+        ends = np.r_[starts[1:], num_cols]
+        result.append("".join([table[row_codes[start]] + line[start:end]
+                               for start, end in zip(starts.tolist(), ends.tolist())]) + RESET)
+    return result
+
+
+def colorize_grid(chars, codes, step=1):
+    """
+    一次性组装整张网格的彩色文本
+
+    chars 为 (rows, cols) 的 ASCII 字节（uint8），codes 为 quantize(colors, step) 的结果。
+    每个单元格先按“转义序列 + 字符”展开成定长字节，再用掩码去掉同色游程中重复的转义序列和数字前导空位，
+    返回 bytes，每行以 RESET 和换行符结尾。
+    """
+    levels = 256 // step
+    values = [b"%3d" % min(level * step + step // 2, 255) for level in range(levels)]
+    digits = np.frombuffer(b"".join(values), dtype=np.uint8).reshape(levels, 3)
+    digit_mask = digits != ord(" ")
+    num_rows, num_cols = codes.shape
+    channels = (codes // (levels * levels), codes // levels % levels, codes % levels)
+
+    # 每个单元格 20 字节："\033[38;2;" + rrr + ";" + ggg + ";" + bbb + "m" + 字符
+    cells = np.empty((num_rows, num_cols, 20), dtype=np.uint8)
+    keep = np.ones((num_rows, num_cols, 20), dtype=bool)
+    cells[:, :, :7] = np.frombuffer(b"\033[38;2;", dtype=np.uint8)
+    for offset, channel in zip((7, 11, 15), channels):
+        cells[:, :, offset:offset + 3] = digits[channel]
+        keep[:, :, offset:offset + 3] = digit_mask[channel]
+    cells[:, :, [10, 14]] = ord(";")
+    cells[:, :, 18] = ord("m")
+    cells[:, :, 19] = chars
+    # 与左侧同色的单元格只保留字符
+    keep[:, 1:, :19] &= (codes[:, 1:] != codes[:, :-1])[:, :, None]
+
+    tail = np.frombuffer((RESET + "\n").encode(), dtype=np.uint8)
+    data = np.hstack([cells.reshape(num_rows, -1), np.broadcast_to(tail, (num_rows, len(tail)))])
+    mask = np.hstack([keep.reshape(num_rows, -1), np.ones((num_rows, len(tail)), dtype=bool)])
+    return data[mask].tobytes()
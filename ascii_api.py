@@ -1,23 +1,32 @@
 # 修改 ascii_api.py 中的导入部分
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-import tempfile
+import asyncio
+import collections
+import io
 import os
+import zipfile
 import uvicorn
 import cv2
 import numpy as np
-from typing import Optional
+from typing import List, Optional
 import imghdr
+import time
 from pathlib import Path
 import sys
 from PIL import Image, ImageDraw, ImageFont, ImageOps
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 # 将当前目录添加到 Python 路径
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 # 导入 img2img 中的函数
-from img2img import get_args, main
+from img2img import AsciiOptions, convert_bytes, load_charset
+from metrics import CONTENT_TYPE, Metrics
+from result_cache import ResultCache, cache_key
+from stage_timer import COUNTERS, STAGES, collect, profile_enabled
 
 app = FastAPI(title="ASCII艺术生成器API")
 
@@ -30,9 +39,129 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 确保输出目录存在
-OUTPUT_DIR = "outputs"
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# 转换进程数、排队上限（不含正在处理的请求）以及单个请求的超时时间（秒）
+CONVERSION_WORKERS = int(os.environ.get("ASCII_WORKERS", os.cpu_count() or 1))
+QUEUE_SIZE = int(os.environ.get("ASCII_QUEUE_SIZE", 2 * CONVERSION_WORKERS))
+REQUEST_TIMEOUT = float(os.environ.get("ASCII_TIMEOUT", 60))
+RETRY_AFTER = int(os.environ.get("ASCII_RETRY_AFTER", 5))
+# 单张图片的大小上限，单次批量请求最多包含的图片数和全部图片（解压后）的总大小上限
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+MAX_BATCH_SIZE = int(os.environ.get("ASCII_MAX_BATCH", 100))
+MAX_BATCH_BYTES = int(os.environ.get("ASCII_MAX_BATCH_BYTES", 200 * 1024 * 1024))
+# zip 压缩包中按扩展名挑选图片，读取前即可计数和检查大小
+BATCH_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# 结果缓存：内存层上限（字节），以及可选的磁盘层目录和上限
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get("ASCII_CACHE_BYTES", 256 * 1024 * 1024)),
+    disk_dir=os.environ.get("ASCII_DISK_CACHE_DIR") or None,
+    disk_max_bytes=int(os.environ.get("ASCII_DISK_CACHE_BYTES", 1024 * 1024 * 1024)),
+)
+
+# 设置 ASCII_PROFILE=1 时在转换进程中统计各阶段耗时和计数，写入 /metrics 和 Server-Timing 响应头
+PROFILE = profile_enabled()
+
+metrics = Metrics()
+metrics.counter("ascii_requests_total", "HTTP requests by path and status code")
+metrics.histogram("ascii_request_duration_seconds", "HTTP request handling time by path")
+metrics.counter("ascii_conversions_total", "Images converted (cache misses)")
+metrics.histogram("ascii_stage_duration_seconds", "Conversion time per stage, measured in the worker process")
+for _counter in COUNTERS:
+    metrics.counter(f"ascii_{_counter}_total", f"Sum of the {_counter} counter over all conversions")
+metrics.gauge("ascii_pending_conversions", "Conversions running or queued")
+metrics.counter("ascii_cache_events_total", "Result cache events by type")
+metrics.gauge("ascii_cache_entries", "Entries in the in-memory result cache")
+metrics.gauge("ascii_cache_bytes", "Bytes held by the result cache by tier")
+
+_executor = None
+_pending = 0
+# 等待转换名额的批量请求（asyncio.Future），名额释放时按顺序唤醒
+_slot_waiters = collections.deque()
+
+
+def get_executor():
+    """懒加载转换进程池，避免在导入模块时就启动子进程"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=CONVERSION_WORKERS)
+    return _executor
+
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _release_slot():
+    """一个转换真正结束（完成、出错或在开始前被取消）时释放它占用的名额"""
+    global _pending
+    _pending -= 1
+    _wake_slot_waiter()
+
+
+def _wake_slot_waiter():
+    while _slot_waiters:
+        waiter = _slot_waiters.popleft()
+        if not waiter.done():
+            waiter.set_result(None)
+            return
+
+
+async def _wait_for_slot():
+    """等待正在处理和排队的请求数降到上限以下"""
+    while _pending >= CONVERSION_WORKERS + QUEUE_SIZE:
+        waiter = asyncio.get_running_loop().create_future()
+        _slot_waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # 已经被唤醒却被取消时，把名额让给下一个等待者
+            if waiter.done() and not waiter.cancelled():
+                _wake_slot_waiter()
+            raise
+
+
+def _release_from_thread(loop):
+    # 回调在进程池的管理线程中执行，交回事件循环线程修改计数；事件循环已关闭时无需释放
+    try:
+        loop.call_soon_threadsafe(_release_slot)
+    except RuntimeError:
+        pass
+
+
+async def run_conversion(func, *args, wait: bool = False):
+    """
+    在进程池中执行转换，避免阻塞事件循环
+
+    正在处理和排队的请求总数超过上限时返回 503 并附带 Retry-After（wait 为真时改为等待名额，
+    用于已经被接受的批量请求中的图片），超时返回 504。
+    名额在进程池中的任务结束时才释放：超时时还在排队的任务被取消，已经开始的任务无法中断，
+    会在后台执行完毕，在此之前仍计入 _pending，避免超时的请求在进程池后面越积越多。
+    """
+    global _pending
+    if wait:
+        await _wait_for_slot()
+    elif _pending >= CONVERSION_WORKERS + QUEUE_SIZE:
+        raise HTTPException(status_code=503, detail="服务器繁忙，请稍后重试",
+                            headers={"Retry-After": str(RETRY_AFTER)})
+    loop = asyncio.get_running_loop()
+    future = get_executor().submit(func, *args)
+    _pending += 1
+    future.add_done_callback(lambda _: _release_from_thread(loop))
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        # wait_for 会取消等待的 future，还没开始的任务随之从进程池队列中移除
+        future.cancel()
+        raise HTTPException(status_code=504, detail="处理超时")
+
+def upload_size(file: UploadFile) -> int:
+    """不读取内容，返回上传文件的字节数"""
+    file.file.seek(0, 2)  # 移动到文件末尾
+    file_size = file.file.tell()
+    file.file.seek(0)  # 移回文件开头
+    return file_size
 
 def validate_image(file: UploadFile):
     """验证上传的图片文件"""
@@ -42,12 +171,7 @@ def validate_image(file: UploadFile):
         raise HTTPException(status_code=400, detail="只支持JPEG和PNG图片")
     
     # 检查文件大小 (最大10MB)
-    max_size = 10 * 1024 * 1024
-    file.file.seek(0, 2)  # 移动到文件末尾
-    file_size = file.file.tell()
-    file.file.seek(0)  # 移回文件开头
-    
-    if file_size > max_size:
+    if upload_size(file) > MAX_UPLOAD_BYTES:
         raise HTTPException(status_code=400, detail="文件大小不能超过10MB")
     
     # 验证图片内容
@@ -56,84 +180,268 @@ def validate_image(file: UploadFile):
         raise HTTPException(status_code=400, detail="无效的图片文件")
     
     file.file.seek(0)  # 再次移回文件开头
-    return True
-
-def process_image(
-    input_path: str,
-    output_path: str,
-    custom_text: str = "江雪利",
-    language: str = "chinese",
-    color: bool = True,
-    portrait: bool = False
-):
-    """处理图片并生成ASCII艺术"""
-    # 准备命令行参数
-    args = [
-        "--input", input_path,
-        "--output", output_path,
-        "--custom_text", custom_text,
-        "--language", language
-    ]
-    
-    if color:
-        args.append("--color")
-    if portrait:
-        args.append("--portrait")
-    
-    # 解析参数
-    args = get_args(args)
-    
-    # 调用主函数
-    main(args)
+    return file_format
+
+@lru_cache(maxsize=16)
+def _load_charset(language: str, mode: str, custom_text: str):
+    """每个转换进程按字符集参数缓存已加载的字体和字符集"""
+    return load_charset(AsciiOptions(language=language, mode=mode, custom_text=custom_text))
+
+def process_image(content: bytes, options: AsciiOptions, image_format: str = "JPEG", profile: bool = False):
+    """
+    处理图片并生成ASCII艺术，输入输出均为编码后的图片字节
+
+    返回 (结果, 各阶段耗时（秒）, 计数)；profile 为 False 时不统计，后两项为空字典。
+    """
+    if not profile:
+        return process_image_bytes(content, options, image_format), {}, {}
+    with collect() as stats:
+        result = process_image_bytes(content, options, image_format)
+    return result, stats.stages, stats.counters
+
+def process_image_bytes(content: bytes, options: AsciiOptions, image_format: str = "JPEG") -> bytes:
+    charset = _load_charset(options.language, options.mode, options.custom_text)
+    return convert_bytes(content, options, image_format, charset)
+
+def record_conversion(stages: dict, counters: dict):
+    """把转换进程返回的阶段耗时和计数累加到指标中"""
+    metrics.inc("ascii_conversions_total")
+    for name, seconds in stages.items():
+        metrics.observe("ascii_stage_duration_seconds", seconds, stage=name)
+    for name, value in counters.items():
+        metrics.inc(f"ascii_{name}_total", value)
+
+def server_timing(stages: dict, cache_hit: bool) -> str:
+    """按 Server-Timing 格式（毫秒）列出各阶段耗时以及是否命中缓存"""
+    entries = [f"{name};dur={stages[name] * 1000:.1f}" for name in STAGES if name in stages]
+    entries.append('cache;desc="hit"' if cache_hit else 'cache;desc="miss"')
+    return ", ".join(entries)
+
+async def generate_cached(key: str, content: bytes, options: AsciiOptions, image_format: str, wait: bool = False):
+    """
+    优先从结果缓存中读取，未命中时在进程池中转换并写入缓存（wait 见 run_conversion）
+
+    返回 (结果, 各阶段耗时, 是否命中缓存)，命中缓存时阶段耗时为空。
+    """
+    result = result_cache.get(key)
+    if result is not None:
+        return result, {}, True
+    result, stages, counters = await run_conversion(process_image, content, options, image_format, PROFILE,
+                                                    wait=wait)
+    result_cache.put(key, result)
+    record_conversion(stages, counters)
+    return result, stages, False
+
+def output_name(filename: str, image_format: str) -> str:
+    extension = image_format.lower().replace("jpeg", "jpg")
+    return f"ascii_{os.path.splitext(os.path.basename(filename))[0]}.{extension}"
 
 @app.post("/api/generate/")
 async def generate_ascii_art(
     file: UploadFile = File(...),
     custom_text: str = Form("江雪利"),
     language: str = Form("chinese"),
+    mode: str = Form("standard"),
     color: bool = Form(True),
-    portrait: bool = Form(False)
+    portrait: bool = Form(False),
+    num_cols: int = Form(300),
+    background: str = Form("black"),
+    if_none_match: Optional[str] = Header(None)
 ):
     """生成ASCII艺术图片"""
     try:
         # 验证文件
-        validate_image(file)
-        
-        # 创建临时文件保存上传的图片
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file.filename.split('.')[-1]}") as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            input_path = temp_file.name
+        file_format = validate_image(file)
+        if background not in ("black", "white"):
+            raise HTTPException(status_code=400, detail="background 只能是 black 或 white")
         
-        # 生成输出路径
-        output_filename = f"ascii_{file.filename}"
-        output_path = os.path.join(OUTPUT_DIR, output_filename)
+        content = await file.read()
+        options = AsciiOptions(language=language, custom_text=custom_text, mode=mode, background=background,
+                               num_cols=num_cols, color=color, portrait=portrait)
+        # 输出格式与上传的图片一致
+        image_format = "PNG" if file_format == "png" else "JPEG"
         
-        # 处理图片
-        process_image(
-            input_path=input_path,
-            output_path=output_path,
-            custom_text=custom_text,
-            language=language,
-            color=color,
-            portrait=portrait
-        )
+        # 相同图片和参数的结果相同，缓存键同时作为 ETag
+        key = cache_key(content, options, image_format)
+        etag = f'"{key}"'
+        if if_none_match and (if_none_match.strip() == "*" or etag in
+                              [tag.strip() for tag in if_none_match.split(",")]):
+            return Response(status_code=304, headers={"ETag": etag})
         
-        # 清理临时文件
-        os.unlink(input_path)
+        result, stages, cache_hit = await generate_cached(key, content, options, image_format)
         
-        # 返回处理后的图片
-        return FileResponse(
-            output_path,
-            media_type="image/jpeg",
-            filename=output_filename
+        # 直接返回内存中的图片
+        output_filename = output_name(file.filename, image_format)
+        headers = {"Content-Disposition": f'attachment; filename="{output_filename}"', "ETag": etag}
+        if PROFILE:
+            headers["Server-Timing"] = server_timing(stages, cache_hit)
+        return Response(
+            content=result,
+            media_type=f"image/{image_format.lower()}",
+            headers=headers
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
-        # 清理临时文件
-        if 'input_path' in locals() and os.path.exists(input_path):
-            os.unlink(input_path)
         raise HTTPException(status_code=500, detail=str(e))
 
+class _ZipStream(io.RawIOBase):
+    """只能追加写入的缓冲区，zipfile 会把它当作不可 seek 的流，边写边取出已完成的数据"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _batch_error(detail: str):
+    return HTTPException(status_code=400, detail=detail)
+
+async def read_batch_images(uploads: List[UploadFile]):
+    """
+    展开上传的文件（zip 压缩包中的图片也会被展开），返回 [(文件名, 图片格式, 内容)]
+
+    读取任何内容之前先检查图片数量、单张图片大小和总大小：普通上传按文件大小，
+    zip 中的图片按目录中记录的解压后大小（解压时不会超过这个大小），防止压缩炸弹或超大请求占满内存。
+    """
+    if len(uploads) > MAX_BATCH_SIZE:
+        raise _batch_error(f"单次最多处理 {MAX_BATCH_SIZE} 张图片")
+    images = []
+    total_bytes = 0
+    for upload in uploads:
+        if zipfile.is_zipfile(upload.file):
+            upload.file.seek(0)
+            with zipfile.ZipFile(upload.file) as archive:
+                entries = [info for info in archive.infolist()
+                           if not info.is_dir() and info.filename.lower().endswith(BATCH_IMAGE_EXTENSIONS)]
+                if len(images) + len(entries) > MAX_BATCH_SIZE:
+                    raise _batch_error(f"单次最多处理 {MAX_BATCH_SIZE} 张图片")
+                for info in entries:
+                    if info.file_size > MAX_UPLOAD_BYTES:
+                        raise _batch_error(f"{info.filename} 超过10MB")
+                total_bytes += sum(info.file_size for info in entries)
+                if total_bytes > MAX_BATCH_BYTES:
+                    raise _batch_error(f"图片总大小不能超过 {MAX_BATCH_BYTES // (1024 * 1024)}MB")
+                for info in entries:
+                    data = archive.read(info)
+                    file_format = imghdr.what(None, h=data)
+                    if file_format in ("jpeg", "png"):
+                        images.append((info.filename, file_format, data))
+        else:
+            # validate_image 在读取内容前检查单张图片的大小
+            file_format = validate_image(upload)
+            if len(images) + 1 > MAX_BATCH_SIZE:
+                raise _batch_error(f"单次最多处理 {MAX_BATCH_SIZE} 张图片")
+            total_bytes += upload_size(upload)
+            if total_bytes > MAX_BATCH_BYTES:
+                raise _batch_error(f"图片总大小不能超过 {MAX_BATCH_BYTES // (1024 * 1024)}MB")
+            images.append((upload.filename, file_format, await upload.read()))
+    if not images:
+        raise _batch_error("没有找到可以处理的图片")
+    return images
+
+@app.post("/api/generate/batch/")
+async def generate_ascii_art_batch(
+    files: List[UploadFile] = File(...),
+    custom_text: str = Form("江雪利"),
+    language: str = Form("chinese"),
+    mode: str = Form("standard"),
+    color: bool = Form(True),
+    portrait: bool = Form(False),
+    num_cols: int = Form(300),
+    background: str = Form("black")
+):
+    """
+    批量生成ASCII艺术图片
+
+    接受多张图片或包含图片的 zip 压缩包，所有图片共用同一组参数，
+    以 zip 流的形式按完成顺序返回结果。
+    """
+    if background not in ("black", "white"):
+        raise HTTPException(status_code=400, detail="background 只能是 black 或 white")
+    images = await read_batch_images(files)
+    options = AsciiOptions(language=language, custom_text=custom_text, mode=mode, background=background,
+                           num_cols=num_cols, color=color, portrait=portrait)
+    if _pending >= CONVERSION_WORKERS + QUEUE_SIZE:
+        raise HTTPException(status_code=503, detail="服务器繁忙，请稍后重试",
+                            headers={"Retry-After": str(RETRY_AFTER)})
+
+    # 批次已被接受，其中的图片等待转换名额而不是返回 503；
+    # 同一批次最多同时占用 CONVERSION_WORKERS 个转换名额，避免挤占其他请求
+    semaphore = asyncio.Semaphore(CONVERSION_WORKERS)
+
+    async def convert_one(index, filename, file_format, content):
+        image_format = "PNG" if file_format == "png" else "JPEG"
+        name = f"{index:04d}_{output_name(filename, image_format)}"
+        async with semaphore:
+            try:
+                key = cache_key(content, options, image_format)
+                result, _, _ = await generate_cached(key, content, options, image_format, wait=True)
+                return name, result
+            except HTTPException as e:
+                return name + ".error.txt", str(e.detail).encode("utf-8")
+            except Exception as e:
+                return name + ".error.txt", str(e).encode("utf-8")
+
+    async def stream():
+        tasks = [asyncio.ensure_future(convert_one(index, *image)) for index, image in enumerate(images)]
+        buffer = _ZipStream()
+        try:
+            with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as archive:
+                for task in asyncio.as_completed(tasks):
+                    name, data = await task
+                    archive.writestr(name, data)
+                    yield buffer.drain()
+            yield buffer.drain()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/zip",
+                             headers={"Content-Disposition": 'attachment; filename="ascii_batch.zip"'})
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """结果缓存的命中、未命中和淘汰计数"""
+    return result_cache.info()
+
+@app.middleware("http")
+async def record_request(request, call_next):
+    """统计每个请求的处理时间和状态码；开启统计时在 Server-Timing 中追加总耗时"""
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    path = request.scope.get("route").path if request.scope.get("route") else "other"
+    metrics.inc("ascii_requests_total", path=path, status=response.status_code)
+    metrics.observe("ascii_request_duration_seconds", elapsed, path=path)
+    if PROFILE:
+        total = f"total;dur={elapsed * 1000:.1f}"
+        existing = response.headers.get("Server-Timing")
+        response.headers["Server-Timing"] = f"{existing}, {total}" if existing else total
+    return response
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 文本格式的请求、转换阶段、计数和缓存指标"""
+    metrics.set("ascii_pending_conversions", _pending)
+    info = result_cache.info()
+    for event in ("hits", "disk_hits", "misses", "evictions", "disk_evictions"):
+        # 缓存自己维护累计值，这里直接覆盖
+        metrics.set("ascii_cache_events_total", info[event], event=event)
+    metrics.set("ascii_cache_entries", info["entries"])
+    metrics.set("ascii_cache_bytes", info["bytes"], tier="memory")
+    metrics.set("ascii_cache_bytes", info["disk_bytes"], tier="disk")
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE)
+
 if __name__ == "__main__":
     uvicorn.run("ascii_api:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
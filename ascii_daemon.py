@@ -0,0 +1,374 @@
+"""
+常驻转换进程：通过 Unix 域套接字复用已导入的模块、已加载的字体、排好序的字符集和字形图集
+
+    python ascii_daemon.py                      # 启动守护进程（前台运行）
+    ASCII_DAEMON=1 python img2img.py ...        # 或加 --daemon：把参数转发给守护进程
+    python ascii_daemon.py --stop
+
+命令行脚本在客户端模式下只发送参数、当前目录和 ASCII_* 环境变量，并把自己的标准输出、标准错误的
+文件描述符一并传过去；守护进程为每个请求 fork 一个子进程，子进程继承预热好的状态，切换到客户端的
+当前目录后运行脚本的 main，输出直接写到客户端的终端或管道，最后返回退出码。
+子进程的 ASCII_* 环境变量换成客户端的，因此脚本在导入后读取的设置（如 ASCII_CACHE_DIR）按客户端生效；
+模块导入时就读取的环境变量在守护进程中不会随客户端变化，新增设置时应在调用时读取。
+守护进程没有运行（或平台不支持）时，客户端照常在本进程中转换。
+
+套接字放在只有当前用户可以访问的目录（0700）中；客户端只连接属于当前用户的套接字，
+并（在支持 SO_PEERCRED 的平台上）确认监听的进程属于当前用户，否则在本进程中转换，
+不会把标准输出、参数和环境变量交给其他用户的进程。
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import stat
+import struct
+import sys
+
+SOCKET_ENV = "ASCII_DAEMON_SOCKET"
+DAEMON_ENV = "ASCII_DAEMON"
+
+# 可以转发给守护进程的脚本
+SCRIPTS = ["img2img", "img2img_color", "img2txt", "chinese_img2img", "improved_ascii_art", "video2video",
+           "video2video_color", "video2txt"]
+
+_HEADER = struct.Struct(">I")
+
+
+def socket_path():
+    """
+    套接字路径：ASCII_DAEMON_SOCKET，否则为 XDG_RUNTIME_DIR 或临时目录下按用户区分的
+    ascii_generator 目录中的 daemon.sock
+    """
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    return os.path.join(_socket_dir(), "daemon.sock")
+
+
+def _socket_dir():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "ascii_generator")
+    return os.path.join("/tmp", "ascii_generator-{}".format(os.getuid()))
+
+
+def _private_dir(path):
+    """目录属于当前用户且其他用户没有任何权限时返回 True"""
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid() and not info.st_mode & 0o077
+
+
+def _owned_socket(path):
+    """path 是属于当前用户的套接字，且默认目录没有被其他用户抢先创建或放宽权限时返回 True"""
+    try:
+        info = os.lstat(path)
+    except OSError:
+        return False
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        return False
+    if not os.environ.get(SOCKET_ENV) and not _private_dir(os.path.dirname(path)):
+        return False
+    return True
+
+
+def _peer_uid(sock):
+    """已连接套接字对端进程的 uid，平台不支持 SO_PEERCRED 时返回 None"""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    credentials = struct.Struct("3i")
+    _, uid, _ = credentials.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, credentials.size))
+    return uid
+
+
+def supported():
+    return (hasattr(socket, "AF_UNIX") and hasattr(socket, "send_fds") and hasattr(os, "fork")
+            and hasattr(os, "getuid"))
+
+
+def add_daemon_args(parser):
+    parser.add_argument("--daemon", action="store_true",
+                        help="forward to a running ascii_daemon.py (or set {}=1); "
+                             "converts in this process when none is running".format(DAEMON_ENV))
+    return parser
+
+
+def _send(sock, message, fds=()):
+    data = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    if fds:
+        socket.send_fds(sock, [_HEADER.pack(len(data)) + data], list(fds))
+    else:
+        sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise ConnectionError("连接已关闭")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _recv(sock, max_fds=0):
+    """读取一条消息，返回 (消息, 文件描述符列表)"""
+    fds = []
+    if max_fds:
+        head, fds, _, _ = socket.recv_fds(sock, _HEADER.size, max_fds)
+        if not head:
+            raise ConnectionError("连接已关闭")
+        head += _recv_exact(sock, _HEADER.size - len(head))
+    else:
+        head = _recv_exact(sock, _HEADER.size)
+    (size,) = _HEADER.unpack(head)
+    return json.loads(_recv_exact(sock, size).decode("utf-8")), fds
+
+
+def _connect():
+    """连接守护进程，没有运行、套接字或监听进程不属于当前用户时返回 None"""
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+    if not _owned_socket(path):
+        print("Ignoring {}: not a socket owned by the current user, or its directory is open to other users"
+              .format(path), file=sys.stderr)
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        peer_uid = _peer_uid(sock)
+    except OSError:
+        sock.close()
+        return None
+    if peer_uid is not None and peer_uid != os.getuid():
+        print("Ignoring {}: the listening process belongs to uid {}".format(path, peer_uid), file=sys.stderr)
+        sock.close()
+        return None
+    return sock
+
+
+def forward(script, argv=None):
+    """
+    客户端模式：命令行带 --daemon 或设置了 ASCII_DAEMON=1 时把参数转发给守护进程并以其退出码退出
+
+    未开启客户端模式、平台不支持或守护进程没有运行时返回 False，由调用方在本进程中转换。
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if "--daemon" not in argv and os.environ.get(DAEMON_ENV, "") in ("", "0"):
+        return False
+    # 帮助信息和启动耗时分析只在本进程中才有意义
+    if not supported() or any(arg in ("-h", "--help", "--startup-profile") for arg in argv):
+        return False
+    sock = _connect()
+    if sock is None:
+        return False
+    env = {key: value for key, value in os.environ.items() if key.startswith("ASCII_")}
+    request = {"script": script, "argv": argv, "cwd": os.getcwd(), "env": env}
+    sys.stdout.flush()
+    sys.stderr.flush()
+    with sock:
+        _send(sock, request, fds=(sys.stdout.fileno(), sys.stderr.fileno()))
+        try:
+            response, _ = _recv(sock)
+        except ConnectionError:
+            print("守护进程在转换过程中退出", file=sys.stderr)
+            sys.exit(1)
+        except KeyboardInterrupt:
+            # 关闭连接后守护进程中的子进程会收到 SIGINT（见 handle），例如 video2txt 停止播放
+            sys.exit(130)
+    sys.exit(response["exit"])
+
+
+def run_script(script, argv):
+    """在当前进程中运行脚本的 main，返回退出码"""
+    import traceback
+    from importlib import import_module
+    from stage_timer import profiled
+
+    module = import_module(script)
+    try:
+        opt = module.get_args(argv)
+        with profiled(opt):
+            module.main(opt)
+    except KeyboardInterrupt:
+        return 130
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def handle(sock):
+    """在 fork 出的子进程中处理一个请求"""
+    request, fds = _recv(sock, max_fds=2)
+    if request.get("command") == "stop":
+        _send(sock, {"exit": 0})
+        os.kill(os.getppid(), signal.SIGTERM)
+        return
+    # 把客户端的标准输出、标准错误接到本进程的 1、2 号文件描述符上
+    for target, fd in zip((1, 2), fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.chdir(request["cwd"])
+    # 客户端的 ASCII_* 环境变量替换守护进程自己的；脚本在 warm_up 时已导入，
+    # 这些设置须在调用时读取（例如 glyph_cache.cache_dir），不能在导入时固定下来
+    env = request.get("env", {})
+    for key in [key for key in os.environ if key.startswith("ASCII_") and key not in env]:
+        del os.environ[key]
+    os.environ.update(env)
+    finished = _interrupt_on_disconnect(sock)
+    if request.get("script") not in SCRIPTS:
+        print("Unknown script: {}".format(request.get("script")), file=sys.stderr)
+        code = 2
+    else:
+        code = run_script(request["script"], request["argv"])
+    finished.set()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        _send(sock, {"exit": code})
+    except OSError:
+        # 客户端已经退出
+        pass
+
+
+def _interrupt_on_disconnect(sock):
+    """
+    客户端在转换结束前断开连接（例如按了 Ctrl-C）时向本进程发送 SIGINT，中断正在运行的脚本
+
+    返回一个 threading.Event，脚本结束后调用方将其置位，之后的断开不再发送信号。
+    """
+    import threading
+
+    finished = threading.Event()
+
+    def watch():
+        try:
+            data = sock.recv(1)
+        except OSError:
+            data = b""
+        if not data and not finished.is_set():
+            os.kill(os.getpid(), signal.SIGINT)
+
+    threading.Thread(target=watch, daemon=True).start()
+    return finished
+
+
+def warm_up(languages):
+    """导入所有脚本，并为 languages 中的字符集加载字体、排序字符、生成字形图集"""
+    import io
+    from contextlib import redirect_stdout
+    from importlib import import_module
+
+    import numpy as np
+    import img2img
+
+    for script in SCRIPTS:
+        import_module(script)
+    # 小图转换一次即可填充字体、字符排序、查找表和图集的缓存（图集与输出宽度无关）
+    image = np.zeros((64, 64, 3), dtype=np.uint8)
+    for language in languages:
+        for color in (False, True):
+            options = img2img.AsciiOptions(language=language, color=color, num_cols=8)
+            try:
+                with redirect_stdout(io.StringIO()):
+                    img2img.convert(image, options, img2img.load_charset(options))
+            except Exception as e:
+                print("Skip warm-up for {}: {}".format(language, e), file=sys.stderr)
+
+
+def serve(path, languages):
+    import socketserver
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            handle(self.request)
+
+    class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+        pass
+
+    # 默认路径的目录只允许当前用户访问；已存在但属于其他用户或权限过宽时拒绝启动
+    if not os.environ.get(SOCKET_ENV):
+        directory = os.path.dirname(path)
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+        if not _private_dir(directory):
+            raise SystemExit("{} must be a directory owned by the current user with mode 0700".format(directory))
+
+    # 已有守护进程在运行时不重复启动；连接不上说明是残留的套接字文件
+    if os.path.exists(path):
+        sock = _connect()
+        if sock is not None:
+            sock.close()
+            raise SystemExit("A daemon is already listening on {}".format(path))
+        os.unlink(path)
+
+    # 套接字文件只允许当前用户连接
+    previous_umask = os.umask(0o177)
+    try:
+        server = Server(path, Handler)
+    finally:
+        os.umask(previous_umask)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        # 绑定套接字之后再预热，其他客户端在此期间连接会排队等待
+        warm_up(languages)
+        print("Listening on {}".format(path), flush=True)
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def stop(path):
+    sock = _connect()
+    if sock is None:
+        print("No daemon is listening on {}".format(path))
+        return
+    with sock:
+        _send(sock, {"command": "stop"})
+        _recv(sock)
+    print("Daemon stopped")
+
+
+def get_args():
+    parser = argparse.ArgumentParser("ASCII conversion daemon")
+    parser.add_argument("--socket", type=str, default="",
+                        help="Unix socket path (default: ${} or a per-user path)".format(SOCKET_ENV))
+    parser.add_argument("--preload", type=str, nargs="*", default=["english"],
+                        help="languages whose fonts, character order and glyph atlases are loaded at start")
+    parser.add_argument("--stop", action="store_true", help="stop the running daemon")
+    args = parser.parse_args()
+    return args
+
+
+def main(opt):
+    if not supported():
+        raise SystemExit("The daemon needs Unix domain sockets and fork()")
+    if opt.socket:
+        os.environ[SOCKET_ENV] = opt.socket
+    path = socket_path()
+    if opt.stop:
+        stop(path)
+    else:
+        serve(path, opt.preload)
+
+
+if __name__ == '__main__':
+    opt = get_args()
+    main(opt)
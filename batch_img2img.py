@@ -0,0 +1,132 @@
+"""
+批量图片转换：把目录或通配符匹配到的所有图片转换为ASCII艺术图片
+"""
+import argparse
+import glob
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import img2img
+from startup import add_startup_args, lazy_import, startup_profile
+
+np = lazy_import("numpy")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+# 每个工作进程只加载一次的字符集和字体
+_opt = None
+_charset = None
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Batch image to ASCII")
+    parser.add_argument("--input", type=str, required=True, help="Input directory or glob pattern")
+    parser.add_argument("--output_dir", type=str, default="outputs", help="Directory for output images")
+    parser.add_argument("--ext", type=str, default="", help="Output extension (default: same as input)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--overwrite", action="store_true", help="Convert again even if the output exists")
+    parser.add_argument("--tile_rows", type=int, default=0,
+                        help="process each image in bands of this many character rows (0: whole image); bounds the memory "
+                             "of statistics, rendering and output, but the decoded input is still held in full")
+    img2img.add_style_args(parser)
+    add_startup_args(parser)
+    args = parser.parse_args()
+    return args
+
+
+def collect_inputs(pattern):
+    if os.path.isdir(pattern):
+        paths = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+    else:
+        paths = glob.glob(pattern, recursive=True)
+    return sorted(path for path in paths if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def output_path_for(opt, input_path, keep_ext=False):
+    """输出路径；keep_ext 时保留源扩展名（a.jpg -> a.jpg.png），用于区分 --ext 下同名的输入"""
+    name = os.path.basename(input_path)
+    stem, ext = os.path.splitext(name)
+    if keep_ext and opt.ext:
+        stem = name
+    return os.path.join(opt.output_dir, stem + (opt.ext or ext))
+
+
+def output_paths(opt, inputs):
+    """
+    返回每个输入的输出路径
+
+    指定 --ext 时 a.jpg 和 a.png 会映射到同一个输出，这些输入改为保留源扩展名；
+    仍然冲突（例如不同目录下的同名文件）时报错，避免输出互相覆盖。
+    """
+    paths = [output_path_for(opt, path) for path in inputs]
+    counts = Counter(paths)
+    paths = [output_path_for(opt, path, keep_ext=counts[output] > 1) for path, output in zip(inputs, paths)]
+    sources = defaultdict(list)
+    for input_path, output_path in zip(inputs, paths):
+        sources[output_path].append(input_path)
+    conflicts = [names for names in sources.values() if len(names) > 1]
+    if conflicts:
+        raise SystemExit("Inputs map to the same output file: " + "; ".join(", ".join(names) for names in conflicts))
+    return paths
+
+
+def _init_worker(opt):
+    global _opt, _charset
+    _opt = opt
+    _charset = img2img.load_charset(opt)
+
+
+def _convert(input_path, output_path):
+    start = time.perf_counter()
+    opt = argparse.Namespace(**vars(_opt))
+    stem, ext = os.path.splitext(output_path)
+    # 先写入临时文件再改名，中断后重新运行时不会把残缺的输出当成已完成
+    opt.input = input_path
+    opt.output = stem + ".part" + ext
+    # 每张图片的调试、保存和内存信息由最后的汇总代替
+    opt.quiet = True
+    img2img.main(opt, _charset)
+    os.replace(opt.output, output_path)
+    return time.perf_counter() - start
+
+
+def main(opt):
+    inputs = collect_inputs(opt.input)
+    os.makedirs(opt.output_dir, exist_ok=True)
+    tasks = []
+    skipped = 0
+    for input_path, output_path in zip(inputs, output_paths(opt, inputs)):
+        if not opt.overwrite and os.path.exists(output_path):
+            skipped += 1
+            continue
+        tasks.append((input_path, output_path))
+    print("Found {} images, {} already converted, {} to convert".format(len(inputs), skipped, len(tasks)))
+
+    latencies = []
+    failed = 0
+    start = time.perf_counter()
+    if tasks:
+        with ProcessPoolExecutor(max_workers=opt.jobs, initializer=_init_worker, initargs=(opt,)) as executor:
+            futures = {executor.submit(_convert, *task): task for task in tasks}
+            for future in as_completed(futures):
+                input_path, output_path = futures[future]
+                try:
+                    latencies.append(future.result())
+                except Exception as e:
+                    failed += 1
+                    print("Failed to convert {}: {}".format(input_path, e))
+    elapsed = time.perf_counter() - start
+
+    print("Converted {} images ({} failed, {} skipped) in {:.2f}s".format(len(latencies), failed, skipped, elapsed))
+    if latencies:
+        p50, p95 = np.percentile(latencies, [50, 95])
+        print("Throughput: {:.2f} images/s, latency p50 {:.3f}s, p95 {:.3f}s".format(
+            len(latencies) / elapsed, p50, p95))
+
+
+if __name__ == '__main__':
+    opt = get_args()
+    with startup_profile(opt):
+        main(opt)
@@ -0,0 +1,202 @@
+"""
+转换器基准测试
+
+使用 demo/ 中的图片、多种分辨率的合成图片和合成视频，逐个运行各转换器的入口函数（main），
+记录总耗时以及解码、单元格统计、选择字符、渲染、编码各阶段的耗时（见 stage_timer），结果输出为 JSON。
+
+    python benchmark.py --output results.json
+    python benchmark.py --quick --converters img2img img2txt --baseline results.json
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import PIL
+from stage_timer import STAGES, collect
+
+DEMO_IMAGES = ["demo/input.jpg", "demo/input2.jpg"]
+
+
+def _image_argv(flag):
+    """生成图片转换器的命令行参数，flag 为该转换器表示输出宽度（字符数）的参数名"""
+    def build(source, output, num_cols, ext):
+        return ["--input", source, "--output", output + ext, flag, str(num_cols)]
+    return build
+
+
+# 转换器名称 -> (输入类型, 输出扩展名, 命令行参数生成函数)
+CONVERTERS = {
+    "img2img": ("image", ".jpg", _image_argv("--num_cols")),
+    "img2img_color": ("image", ".jpg", _image_argv("--num_cols")),
+    "img2txt": ("image", ".txt", _image_argv("--num_cols")),
+    "chinese_img2img": ("image", ".jpg", _image_argv("--num_cols")),
+    "improved_ascii_art": ("image", ".jpg", _image_argv("--width")),
+    "video2video": ("video", ".avi", _image_argv("--num_cols")),
+    "video2video_color": ("video", ".avi", _image_argv("--num_cols")),
+}
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Converter benchmark")
+    parser.add_argument("--converters", nargs="+", default=list(CONVERTERS), choices=list(CONVERTERS),
+                        help="converters to benchmark")
+    parser.add_argument("--widths", nargs="+", type=int, default=[640, 1920, 4000],
+                        help="widths of the synthetic images")
+    parser.add_argument("--num_cols", nargs="+", type=int, default=[80, 300],
+                        help="output widths in characters for image converters")
+    parser.add_argument("--video_widths", nargs="+", type=int, default=[640, 1280],
+                        help="widths of the synthetic videos")
+    parser.add_argument("--video_cols", nargs="+", type=int, default=[100], help="output widths for video converters")
+    parser.add_argument("--frames", type=int, default=30, help="frames per synthetic video")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per case")
+    parser.add_argument("--quick", action="store_true", help="smallest inputs and a single timed run")
+    parser.add_argument("--output", type=str, default="", help="Path to the JSON results (default: stdout)")
+    parser.add_argument("--baseline", type=str, default="", help="Earlier JSON results to compare against")
+    args = parser.parse_args()
+    return args
+
+
+def synthetic_image(width, height, seed=0):
+    """渐变背景上叠加圆形、直线和噪声，包含平坦区域、边缘和纹理"""
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.dstack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                       (x + y) / 2]).astype(np.uint8)
+    thickness = max(1, width // 200)
+    for _ in range(12):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(image, center, int(rng.integers(width // 20, width // 5)), color, thickness)
+        cv2.line(image, (int(rng.integers(width)), 0), (int(rng.integers(width)), height - 1), color, thickness)
+    noise = rng.normal(0, 12, image.shape)
+    return np.clip(image + noise, 0, 255).astype(np.uint8)
+
+
+def prepare_inputs(opt, workdir):
+    """生成测试输入，返回 {"image": [(名称, 路径)], "video": [(名称, 路径)]}"""
+    images = [(os.path.basename(path), path) for path in DEMO_IMAGES if os.path.exists(path)]
+    for width in opt.widths:
+        height = width * 3 // 4
+        path = os.path.join(workdir, "synthetic_{}.jpg".format(width))
+        cv2.imwrite(path, synthetic_image(width, height), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        images.append(("synthetic_{}x{}".format(width, height), path))
+
+    videos = []
+    for width in opt.video_widths:
+        height = width * 9 // 16
+        base = synthetic_image(width, height, seed=1)
+        path = os.path.join(workdir, "synthetic_{}.avi".format(width))
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"XVID"), 30, (width, height))
+        for index in range(opt.frames):
+            # 每帧平移一段距离，模拟运动
+            writer.write(np.roll(base, index * width // 100, axis=1))
+        writer.release()
+        videos.append(("synthetic_{}x{}_{}f".format(width, height, opt.frames), path))
+    return {"image": images, "video": videos}
+
+
+def run_case(module, argv, repeat):
+    """预热一次后运行 repeat 次，返回总耗时、各阶段耗时（毫秒）和最后一次运行的计数"""
+    totals = []
+    stages = {name: [] for name in STAGES}
+    for run in range(repeat + 1):
+        opt = module.get_args(argv)
+        with contextlib.redirect_stdout(io.StringIO()), collect() as profile:
+            start = time.perf_counter()
+            module.main(opt)
+            elapsed = time.perf_counter() - start
+        if run == 0:
+            continue
+        totals.append(elapsed * 1000)
+        for name in STAGES:
+            stages[name].append(profile.stages.get(name, 0.0) * 1000)
+    stage_ms = {name: round(statistics.median(values), 3) for name, values in stages.items()}
+    total_ms = statistics.median(totals)
+    # 字体加载、网格计算等不属于任何阶段的时间
+    stage_ms["other"] = round(max(total_ms - sum(stage_ms.values()), 0.0), 3)
+    return {
+        "total_ms": {"min": round(min(totals), 3), "median": round(total_ms, 3)},
+        "stages_ms": stage_ms,
+        "counters": dict(profile.counters),
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "pillow": PIL.__version__,
+    }
+
+
+def compare(results, baseline_path):
+    """打印与之前结果相比的中位数耗时变化"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {case["case"]: case for case in json.load(f)["results"]}
+    print("\n{:<56}{:>12}{:>12}{:>9}".format("case", "baseline", "current", "ratio"))
+    for case in results:
+        old = baseline.get(case["case"])
+        if old is None:
+            continue
+        before, after = old["total_ms"]["median"], case["total_ms"]["median"]
+        print("{:<56}{:>12.1f}{:>12.1f}{:>8.2f}x".format(case["case"], before, after, after / before if before else 0.0))
+
+
+def main(opt):
+    if opt.quick:
+        opt.widths = opt.widths[:1]
+        opt.video_widths = opt.video_widths[:1]
+        opt.frames = min(opt.frames, 10)
+        opt.repeat = 1
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        inputs = prepare_inputs(opt, workdir)
+        for name in opt.converters:
+            kind, ext, build_argv = CONVERTERS[name]
+            module = importlib.import_module(name)
+            for input_name, path in inputs[kind]:
+                for num_cols in (opt.video_cols if kind == "video" else opt.num_cols):
+                    argv = build_argv(path, os.path.join(workdir, "output"), num_cols, ext)
+                    result = run_case(module, argv, opt.repeat)
+                    case = "{}/{}/{}cols".format(name, input_name, num_cols)
+                    results.append(dict(case=case, converter=name, input=input_name, num_cols=num_cols, **result))
+                    stages = " ".join("{}={:.1f}".format(stage, ms) for stage, ms in result["stages_ms"].items())
+                    print("{:<56}{:>10.1f} ms  {}".format(case, result["total_ms"]["median"], stages),
+                          file=sys.stderr)
+
+    report = {"environment": environment(), "repeat": opt.repeat, "results": results}
+    if opt.output:
+        with open(opt.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print("Results saved to {}".format(opt.output))
+    else:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    if opt.baseline:
+        compare(results, opt.baseline)
+
+
+if __name__ == '__main__':
+    opt = get_args()
+    main(opt)
@@ -0,0 +1,84 @@
+"""
+比较按亮度映射与按字形结构匹配：选字耗时，以及渲染结果与原图的相关系数
+
+相关系数在 --match_grid 决定的子块分辨率上计算（白底黑字渲染，与原图同向），越接近 1 说明
+字符画越能还原原图的明暗分布和轮廓。
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+from cell_stats import cell_bounds, grid_means
+from glyph_atlas import get_atlas
+from glyph_lut import map_cells
+from glyph_match import get_matcher, match_cells
+from img2img import load_charset
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Glyph matching benchmark")
+    parser.add_argument("--input", type=str, default="data/input.jpg", help="Path to input image")
+    parser.add_argument("--language", type=str, default="english")
+    parser.add_argument("--mode", type=str, default="standard")
+    parser.add_argument("--num_cols", type=int, default=300, help="number of character for output's width")
+    parser.add_argument("--match_grid", type=int, default=4, help="descriptor columns per character")
+    parser.add_argument("--gamma", type=float, default=1.0)
+    parser.add_argument("--skip_darkest", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=10, help="timed runs per method")
+    args = parser.parse_args()
+    return args
+
+
+def time_call(func, repeat):
+    """返回 (结果, 最快一次的耗时毫秒数)"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return result, best * 1000
+
+
+def fidelity(gray, ys, xs, atlas, char_indices, grid_cols, grid_rows):
+    """白底黑字渲染 char_indices，与原图在子块分辨率上计算相关系数"""
+    num_rows, num_cols = char_indices.shape
+    size = (num_cols * grid_cols, num_rows * grid_rows)
+    rendered = atlas.render(char_indices, 255, foreground=0)
+    rendered = cv2.resize(rendered, size, interpolation=cv2.INTER_AREA).astype(np.float64)
+    source = cv2.resize(gray[ys[0]:ys[-1], xs[0]:xs[-1]], size, interpolation=cv2.INTER_AREA).astype(np.float64)
+    return float(np.corrcoef(rendered.ravel(), source.ravel())[0, 1])
+
+
+def main(opt):
+    opt.custom_text = ""
+    char_list, font, sample_character, scale = load_charset(opt)
+    gray = cv2.imread(opt.input, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError("无法加载图片: {}".format(opt.input))
+    height, width = gray.shape
+    cell_width = width / opt.num_cols
+    cell_height = scale * cell_width
+    num_rows = int(height / cell_height)
+    ys = cell_bounds(height, cell_height, num_rows)
+    xs = cell_bounds(width, cell_width, opt.num_cols)
+    bbox = font.getbbox(sample_character)
+    atlas = get_atlas(font, char_list, bbox[2] - bbox[0], int(round(scale * (bbox[3] - bbox[1]))))
+    matcher = get_matcher(atlas, opt.match_grid)
+
+    methods = {
+        "brightness": lambda: map_cells(grid_means(gray, ys, xs), len(char_list), opt.gamma, opt.skip_darkest),
+        "structure": lambda: match_cells(gray, ys, xs, atlas, opt.match_grid, opt.gamma, opt.skip_darkest),
+    }
+    print("{} x {} cells, {} characters, {}x{} descriptor grid".format(
+        opt.num_cols, num_rows, len(char_list), matcher.grid_cols, matcher.grid_rows))
+    print("{:<12}{:>12}{:>14}{:>14}".format("method", "time (ms)", "correlation", "characters"))
+    for name, func in methods.items():
+        char_indices, elapsed = time_call(func, opt.repeat)
+        score = fidelity(gray, ys, xs, atlas, char_indices, matcher.grid_cols, matcher.grid_rows)
+        print("{:<12}{:>12.2f}{:>14.4f}{:>14d}".format(name, elapsed, score, len(np.unique(char_indices))))
+
+
+if __name__ == '__main__':
+    opt = get_args()
+    main(opt)
@@ -1,5 +1,9 @@
 # -*- mode: python ; coding: utf-8 -*-
 
+# 打包为单目录（dist/ASCIIGenerator/ASCIIGenerator）而不是单文件：单文件程序每次启动都要把
+# 全部依赖（其中 OpenCV 的动态库最大）解压到临时目录，批量调用时启动耗时远大于转换本身。
+# 同理不使用 UPX，避免每次加载动态库时解压。
+
 block_cipher = None
 
 a = Analysis(
@@ -7,17 +11,30 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
+    # 延迟导入（startup.lazy_import）的模块不会被静态分析发现，需要显式列出
     hiddenimports=[
         'cv2',
         'numpy',
-        'PIL',
-        'PIL._imagingtk',
-        'PIL._tkinter_finder',
+        'PIL.Image',
+        'PIL.ImageDraw',
+        'PIL.ImageFont',
+        'PIL.ImageOps',
+        'PIL.ImageSequence',
+        'PIL.GifImagePlugin',
     ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # 转换用不到的大型模块
+    excludes=[
+        'tkinter',
+        'PIL.ImageTk',
+        'PIL._tkinter_finder',
+        'matplotlib',
+        'IPython',
+        'fastapi',
+        'uvicorn',
+    ],
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -28,17 +45,13 @@ pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
 exe = EXE(
     pyz,
     a.scripts,
-    a.binaries,
-    a.zipfiles,
-    a.datas,
     [],
+    exclude_binaries=True,
     name='ASCIIGenerator',
     debug=False,
     bootloader_ignore_signals=False,
     strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
+    upx=False,
     console=True,
     disable_windowed_traceback=False,
     target_arch=None,
@@ -46,3 +59,13 @@ exe = EXE(
     argv_emulation=False,
     entitlements_file=None,
 )
+
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.zipfiles,
+    a.datas,
+    strip=False,
+    upx=False,
+    name='ASCIIGenerator',
+)
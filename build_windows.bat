@@ -12,5 +12,5 @@ pip install -r requirements.txt
 REM 使用 PyInstaller 构建
 pyinstaller --clean --noconfirm build.spec
 
-echo 构建完成！可执行文件位于 dist 目录下
+echo 构建完成！可执行文件位于 dist\ASCIIGenerator 目录下
 pause
@@ -5,7 +5,8 @@
 import argparse
 import cv2
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+from font_registry import find_font
 
 def get_args():
     parser = argparse.ArgumentParser("Character Set ASCII Art")
@@ -52,14 +53,8 @@ def main():
         output_img = Image.new('RGB', (new_width * font_size, new_height * font_size * 2), color='white')
         draw = ImageDraw.Draw(output_img)
         
-        # 尝试加载中文字体
-        try:
-            font = ImageFont.truetype("PingFang.ttc", font_size)
-        except:
-            try:
-                font = ImageFont.truetype("Arial Unicode.ttf", font_size)
-            except:
-                font = ImageFont.load_default()
+        # 从字体注册表中选择能显示全部字符的字体
+        font = find_font("".join(mixed_chars), font_size)
         
         # 生成ASCII艺术
         for i in range(new_height):
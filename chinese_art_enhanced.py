@@ -5,8 +5,8 @@
 import argparse
 import cv2
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-import os
+from PIL import Image, ImageDraw
+from font_registry import find_font
 
 def get_args():
     parser = argparse.ArgumentParser("Enhanced Chinese Character ASCII Art")
@@ -17,25 +17,6 @@ def get_args():
     parser.add_argument("--contrast", type=float, default=2.0, help="对比度增强系数（1.0-3.0）")
     return parser.parse_args()
 
-def load_font(font_size):
-    """尝试加载中文字体"""
-    font_paths = [
-        "/System/Library/Fonts/PingFang.ttc",  # macOS
-        "C:/Windows/Fonts/msyh.ttc",           # Windows 雅黑
-        "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",  # Linux
-    ]
-    
-    for path in font_paths:
-        if os.path.exists(path):
-            try:
-                return ImageFont.truetype(path, font_size)
-            except:
-                continue
-    
-    # 如果找不到中文字体，使用默认字体
-    print("警告：未找到中文字体，将使用默认字体")
-    return ImageFont.load_default()
-
 def main():
     args = get_args()
     
@@ -64,25 +45,15 @@ def main():
         chars = "刘德华"
         char_imgs = []
         
+        # 从字体注册表中选择能显示这些字符的中文字体
+        font = find_font(chars, args.font_size)
+        
         # 为每个字符创建图片
         for char in chars:
             # 创建临时图片
             temp_img = Image.new('L', (char_size, char_size), 255)
             draw = ImageDraw.Draw(temp_img)
             
-            # 尝试使用不同字体大小
-            for fs in range(args.font_size, 5, -1):
-                try:
-                    font = ImageFont.truetype("PingFang.ttc", fs)
-                    break
-                except:
-                    try:
-                        font = ImageFont.truetype("Arial Unicode.ttf", fs)
-                        break
-                    except:
-                        if fs == 6:  # 如果都失败，使用默认字体
-                            font = ImageFont.load_default()
-            
             # 绘制字符
             draw.text((0, 0), char, fill=0, font=font)
             char_imgs.append(temp_img)
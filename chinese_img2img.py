@@ -2,46 +2,46 @@
 使用中文字符生成ASCII艺术图片
 """
 import argparse
-import cv2
-import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+import os
+from ascii_daemon import add_daemon_args, forward
+from cell_stats import cell_bounds, grid_means
+from font_registry import find_font
+from glyph_lut import add_lut_args, map_cells
+from stage_timer import add_profile_args, count, profiled, stage
+from startup import add_startup_args, lazy_import, startup_profile
 
-def get_args():
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser("Chinese Character ASCII Art")
     parser.add_argument("--input", type=str, default="demo/input.jpg", help="输入图片路径")
     parser.add_argument("--output", type=str, default="demo/chinese_output.jpg", help="输出图片路径")
     parser.add_argument("--chars", type=str, default="刘德华", help="用于生成ASCII艺术的字符")
     parser.add_argument("--num_cols", type=int, default=50, help="输出图片的字符宽度")
     parser.add_argument("--font_size", type=int, default=20, help="字体大小")
-    return parser.parse_args()
+    add_lut_args(parser)
+    add_profile_args(parser)
+    add_startup_args(parser)
+    add_daemon_args(parser)
+    return parser.parse_args(argv)
 
-def main():
-    args = get_args()
-    
+def main(args):
     # 读取图片并转为灰度图
-    image = cv2.imread(args.input)
+    with stage("decode"):
+        image = cv2.imread(args.input)
     if image is None:
         print(f"错误：无法读取图片 {args.input}")
         return
         
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    with stage("stats"):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     height, width = gray.shape
     
-    # 尝试加载中文字体
-    try:
-        # 尝试加载系统默认中文字体
-        font = ImageFont.truetype("Arial Unicode.ttf", args.font_size)
-    except IOError:
-        try:
-            # 如果找不到Arial Unicode，尝试其他常见中文字体
-            font = ImageFont.truetype("SimHei.ttf", args.font_size)
-        except IOError:
-            try:
-                font = ImageFont.truetype("msyh.ttc", args.font_size)
-            except IOError:
-                # 如果都找不到，使用默认字体
-                print("警告：未找到中文字体，将使用默认字体，可能无法正确显示中文")
-                font = ImageFont.load_default()
+    # 从字体注册表中选择能显示这些字符的中文字体
+    font = find_font(args.chars, args.font_size)
     # 获取字符大小
     bbox = font.getbbox("刘")
     char_width = bbox[2] - bbox[0]
@@ -59,24 +59,24 @@ def main():
     out_image = Image.new("RGB", (out_width, out_height), "white")
     draw = ImageDraw.Draw(out_image)
     
+    # 一次性计算所有单元格的平均灰度值（单元格不包含最后一行和最后一列像素）
+    count("cells", num_rows * num_cols)
+    with stage("stats"):
+        ys = np.minimum(cell_bounds(height, cell_height, num_rows), height - 1)
+        xs = np.minimum(cell_bounds(width, cell_width, num_cols), width - 1)
+        avg_intensity = grid_means(gray, ys, xs)
+        # 空的单元格不绘制字符
+        non_empty = np.outer(np.diff(ys) > 0, np.diff(xs) > 0)
+    
+    # 根据灰度值选择字符
+    with stage("select"):
+        char_indices = map_cells(avg_intensity, len(args.chars), args.gamma, args.skip_darkest)
+    
     # 生成ASCII艺术
-    for i in range(num_rows):
-        for j in range(num_cols):
-            # 计算当前单元格的像素区域
-            x1 = int(j * cell_width)
-            y1 = int(i * cell_height)
-            x2 = min(int((j + 1) * cell_width), width - 1)
-            y2 = min(int((i + 1) * cell_height), height - 1)
-            
-            # 计算单元格的平均灰度值
-            cell = gray[y1:y2, x1:x2]
-            if cell.size == 0:
-                continue
-            avg_intensity = np.mean(cell)
-            
-            # 根据灰度值选择字符
-            char_index = int((avg_intensity / 255.0) * (len(args.chars) - 1))
-            char = args.chars[char_index]
+    count("glyphs", np.count_nonzero(non_empty))
+    with stage("render"):
+        for i, j in zip(*np.nonzero(non_empty)):
+            char = args.chars[char_indices[i, j]]
             
             # 计算字符位置
             x = j * char_width
@@ -86,8 +86,14 @@ def main():
             draw.text((x, y), char, fill="black", font=font)
     
     # 保存图片
-    out_image.save(args.output)
+    with stage("encode"):
+        out_image.save(args.output)
+    count("bytes_written", os.path.getsize(args.output))
     print(f"ASCII艺术图片已保存到: {args.output}")
 
 if __name__ == '__main__':
-    main()
+    # 守护进程在运行时由它转换（见 ascii_daemon），否则在本进程中转换
+    forward('chinese_img2img')
+    opt = get_args()
+    with startup_profile(opt), profiled(opt):
+        main(opt)
@@ -0,0 +1,119 @@
+"""
+进程级字体注册表：字体只探测、加载一次
+
+- get_font(path, size)：按 (路径, 字号) 缓存 FreeTypeFont
+- find_font(text, size)：在候选字体中找到第一个能显示 text 中所有字符的字体
+"""
+import os
+import platform
+from functools import lru_cache
+
+from startup import lazy_import
+
+ImageFont = lazy_import("PIL.ImageFont")
+
+FONT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts")
+
+# 中日韩字体候选，按优先级排列；不带目录的文件名由 PIL 在系统字体目录中查找
+if platform.system().lower() == "darwin":
+    CJK_FONTS = [
+        "/System/Library/Fonts/PingFang.ttc",
+        "/System/Library/Fonts/STHeiti Light.ttc",
+        "/System/Library/Fonts/Hiragino Sans GB W3.ttc",
+        "/Library/Fonts/Arial Unicode.ttf",
+    ]
+elif platform.system().lower() == "windows":
+    CJK_FONTS = [
+        "C:/Windows/Fonts/msyh.ttc",  # 微软雅黑
+        "C:/Windows/Fonts/simhei.ttf",  # 黑体
+        "C:/Windows/Fonts/simsun.ttc",  # 宋体
+    ]
+else:
+    CJK_FONTS = [
+        "/usr/share/fonts/chinese/simsun.ttf",
+        "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+        "/usr/share/fonts/truetype/arphic/ukai.ttc",
+        "/usr/share/fonts/truetype/arphic/uming.ttc",
+        "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+        "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
+    ]
+CJK_FONTS += [
+    "fonts/simsun.ttc",
+    "fonts/arial-unicode.ttf",
+    "Arial Unicode.ttf",
+    "PingFang.ttc",
+    "SimHei.ttf",
+    "msyh.ttc",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
+    "fonts/DejaVuSansMono.ttf",
+]
+
+# 等宽字体候选
+MONO_FONTS = [
+    "/System/Library/Fonts/Menlo.ttc",
+    "C:/Windows/Fonts/consola.ttf",
+    "fonts/DejaVuSansMono.ttf",
+]
+
+# 几乎不可能被字体收录的码位，用来得到字体的缺字符号（.notdef）
+_MISSING_CHAR = "\U0010fffd"
+
+
+def resolve_path(path):
+    """相对路径先按当前目录查找，找不到时再按本仓库目录查找"""
+    if os.path.isabs(path) or os.path.exists(path):
+        return path
+    local_path = os.path.join(os.path.dirname(FONT_DIR), path)
+    if os.path.exists(local_path):
+        return local_path
+    return path
+
+
+@lru_cache(maxsize=None)
+def get_font(path, size):
+    """加载并缓存字体，找不到字体时与 ImageFont.truetype 一样抛出 OSError"""
+    return ImageFont.truetype(resolve_path(path), size=size)
+
+
+@lru_cache(maxsize=None)
+def _loadable(path):
+    try:
+        get_font(path, 10)
+    except OSError:
+        return False
+    return True
+
+
+def available_fonts(candidates):
+    """返回候选中能够加载的字体（探测结果在进程内缓存）"""
+    return [path for path in candidates if _loadable(path)]
+
+
+def _glyph_signature(font, char):
+    mask = font.getmask(char)
+    return mask.size, bytes(mask)
+
+
+def covers(font, text):
+    """字体是否包含 text 中的所有字符（空白字符不检查）"""
+    missing = _glyph_signature(font, _MISSING_CHAR)
+    return all(_glyph_signature(font, char) != missing for char in set(text) if not char.isspace())
+
+
+@lru_cache(maxsize=64)
+def find_font(text, size, candidates=tuple(CJK_FONTS)):
+    """
+    返回候选中第一个能显示 text 的字体
+
+    没有字体能完整显示时退回第一个可加载的候选，再退回 PIL 的默认字体。
+    """
+    paths = available_fonts(candidates)
+    for path in paths:
+        font = get_font(path, size)
+        if covers(font, text):
+            return font
+    if paths:
+        print("警告: 没有字体包含全部字符 {}，使用 {}".format(text, paths[0]))
+        return get_font(paths[0], size)
+    print("警告: 未找到合适的字体，将使用默认字体，可能无法正确显示字符")
+    return ImageFont.load_default()
@@ -0,0 +1,101 @@
+"""
+字形图集：每个字符只光栅化一次，之后通过数组索引拼出整张输出图片
+"""
+from functools import lru_cache
+
+from startup import lazy_import
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+
+
+class GlyphAtlas:
+    """保存 char_list 中每个字符在 (cell_width, cell_height) 单元格内的覆盖率蒙版"""
+
+    def __init__(self, font, char_list, cell_width, cell_height):
+        self.char_list = char_list
+        self.cell_width = int(cell_width)
+        self.cell_height = int(cell_height)
+        tiles = []
+        for char in char_list:
+            tile = Image.new("L", (self.cell_width, self.cell_height), 0)
+            ImageDraw.Draw(tile).text((0, 0), char, fill=255, font=font)
+            tiles.append(np.array(tile))
+        # (字符数, 单元格高, 单元格宽)，值为 0-255 的覆盖率
+        self.tiles = np.stack(tiles)
+
+    def masks(self, char_indices):
+        """根据 (rows, cols) 的字符索引拼出 (rows * cell_height, cols * cell_width) 的覆盖率图"""
+        num_rows, num_cols = char_indices.shape
+        masks = self.tiles[char_indices]
+        return masks.transpose(0, 2, 1, 3).reshape(num_rows * self.cell_height, num_cols * self.cell_width)
+
+    def render(self, char_indices, background, foreground=None, colors=None, out=None):
+        """
+        渲染输出图片
+
+        灰度模式传入 foreground（0-255），彩色模式传入 (rows, cols, C) 的 colors，
+        background 为对应的灰度值或颜色元组。返回 uint8 数组；传入 out 时结果写入 out。
+        """
+        mask = self.masks(char_indices).astype(np.uint16)
+        if colors is None:
+            result = (background * (255 - mask) + foreground * mask + 127) // 255
+            return self._output(result, out)
+        num_rows, num_cols = char_indices.shape
+        colors = np.asarray(colors, dtype=np.uint16)
+        # 把每个单元格的颜色扩展到单元格内的每个像素
+        colors = np.broadcast_to(colors[:, None, :, None, :],
+                                 (num_rows, self.cell_height, num_cols, self.cell_width, colors.shape[-1]))
+        colors = colors.reshape(num_rows * self.cell_height, num_cols * self.cell_width, -1)
+        background = np.asarray(background, dtype=np.uint16)
+        mask = mask[:, :, None]
+        result = (background * (255 - mask) + colors * mask + 127) // 255
+        return self._output(result, out)
+
+    def render_indexed(self, char_indices, cell_indices, background=0, out=None):
+        """
+        调色板模式的渲染：覆盖率不低于一半的像素取所在单元格的索引 cell_indices，其余为 background
+
+        返回 (rows * cell_height, cols * cell_width) 的 uint8 索引图；传入 out 时结果写入 out。
+        """
+        num_rows, num_cols = char_indices.shape
+        ink = self.masks(char_indices) >= 128
+        cell_indices = np.broadcast_to(np.asarray(cell_indices, dtype=np.uint8)[:, None, :, None],
+                                       (num_rows, self.cell_height, num_cols, self.cell_width))
+        cell_indices = cell_indices.reshape(ink.shape)
+        if out is None:
+            return np.where(ink, cell_indices, np.uint8(background))
+        out[...] = background
+        np.copyto(out, cell_indices, where=ink)
+        return out
+
+    def render_cells(self, out, rows, cols, char_indices, background, colors):
+        """
+        只重新渲染 (rows[k], cols[k]) 处的单元格，直接写入彩色输出 out
+
+        out 必须是之前由 render 生成的连续数组，其余单元格保持不变。
+        """
+        mask = self.tiles[char_indices[rows, cols]].astype(np.uint16)[:, :, :, None]
+        colors = np.asarray(colors[rows, cols], dtype=np.uint16)[:, None, None, :]
+        background = np.asarray(background, dtype=np.uint16)
+        patch = (background * (255 - mask) + colors * mask + 127) // 255
+        num_rows = out.shape[0] // self.cell_height
+        num_cols = out.shape[1] // self.cell_width
+        # 按单元格重新排列的视图，(行, 单元格高, 列, 单元格宽, 通道)
+        grid = out.reshape(num_rows, self.cell_height, num_cols, self.cell_width, -1)
+        grid[rows, :, cols] = patch
+        return out
+
+    @staticmethod
+    def _output(result, out):
+        if out is None:
+            return result.astype(np.uint8)
+        np.copyto(out, result, casting="unsafe")
+        return out
+
+
+@lru_cache(maxsize=32)
+def get_atlas(font, char_list, cell_width, cell_height):
+    """按 (字体, 字符集, 单元格大小) 缓存图集"""
+    return GlyphAtlas(font, char_list, cell_width, cell_height)
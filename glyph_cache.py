@@ -0,0 +1,144 @@
+"""
+字符亮度排序（sort_chars）结果的缓存
+
+缓存键为 (字体文件哈希, 字号, 字符集, 语言)，同时保存在进程内（LRU）和磁盘上，
+磁盘目录可以通过环境变量 ASCII_CACHE_DIR 指定（每次访问时读取，守护进程也能使用客户端的设置）。
+"""
+import argparse
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from functools import lru_cache
+
+CACHE_DIR_ENV = "ASCII_CACHE_DIR"
+# 进程内 LRU 缓存的条目数
+MEMORY_SIZE = 128
+# 字体文件 (路径, 修改时间, 大小) 到内容哈希的索引
+DIGESTS_FILE = "font_digests.json"
+
+_memory = OrderedDict()
+
+
+def cache_dir():
+    """磁盘缓存目录：ASCII_CACHE_DIR，默认为 ~/.cache/ascii_generator"""
+    return os.environ.get(CACHE_DIR_ENV) or os.path.join(os.path.expanduser("~"), ".cache", "ascii_generator")
+
+
+@lru_cache(maxsize=None)
+def _file_digest(path, mtime, size):
+    # mtime 和 size 只用于在字体文件变化时使缓存失效；哈希同时记录在磁盘上，
+    # 每个新进程不必重新读取整个字体文件（中日韩字体通常有十几 MB）
+    index_key = "{}|{}|{}".format(path, mtime, size)
+    digests = _load_digests()
+    if index_key in digests:
+        return digests[index_key]
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    digests[index_key] = digest.hexdigest()
+    _store_json(os.path.join(cache_dir(), DIGESTS_FILE), digests)
+    return digests[index_key]
+
+
+def _load_digests():
+    try:
+        with open(os.path.join(cache_dir(), DIGESTS_FILE), encoding="utf-8") as f:
+            digests = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return digests if isinstance(digests, dict) else {}
+
+
+def font_digest(font):
+    """返回字体文件的哈希，无法定位字体文件时返回 None"""
+    path = getattr(font, "path", None)
+    if not isinstance(path, str) or not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return _file_digest(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def _cache_path(key):
+    name = hashlib.sha1(json.dumps(key, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(), name + ".json")
+
+
+def _load(key):
+    try:
+        with open(_cache_path(key), encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get("key") != list(key):
+        return None
+    return entry["chars"], entry["densities"]
+
+
+def _store(key, chars, densities):
+    _store_json(_cache_path(key), {"key": list(key), "chars": chars, "densities": densities})
+
+
+def _store_json(path, data):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换，避免并发进程读到写了一半的文件
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print("Failed to write glyph cache {}: {}".format(path, e))
+
+
+def get_ranking(char_list, font, language, compute):
+    """
+    返回 (排序后的字符串, 每个字符的亮度列表)
+
+    compute 为无参函数，缓存未命中时调用并返回同样的二元组。
+    """
+    digest = font_digest(font)
+    if digest is None:
+        return compute()
+    key = (digest, getattr(font, "size", None), char_list, language)
+    if key in _memory:
+        _memory.move_to_end(key)
+        return _memory[key]
+    entry = _load(key)
+    if entry is None:
+        entry = compute()
+        _store(key, *entry)
+    _memory[key] = entry
+    if len(_memory) > MEMORY_SIZE:
+        _memory.popitem(last=False)
+    return entry
+
+
+def get_args():
+    parser = argparse.ArgumentParser("Glyph cache warm-up")
+    parser.add_argument("--languages", type=str, nargs="*", default=None,
+                        help="Languages to precompute (default: every language in alphabets.py)")
+    args = parser.parse_args()
+    return args
+
+
+def main(opt):
+    import alphabets
+    from utils import LANGUAGES, get_data
+
+    languages = opt.languages or LANGUAGES
+    for language in languages:
+        for mode in getattr(alphabets, language.upper()):
+            try:
+                char_list, _, _, _ = get_data(language, mode)
+            except OSError as e:
+                print("Skip {} ({}): {}".format(language, mode, e))
+                continue
+            if char_list is not None:
+                print("Cached {} ({}): {} characters".format(language, mode, len(char_list)))
+
+
+if __name__ == '__main__':
+    opt = get_args()
+    main(opt)
@@ -0,0 +1,46 @@
+"""
+亮度到字符索引的查找表
+
+所有转换器共用同一套映射：灰度归一化后做 gamma 校正，跳过最暗的 skip_darkest 个字符，
+再均匀分配到剩余字符上。查找表按 (字符数, gamma, skip_darkest, 精度) 缓存，
+整张网格只需一次 np.take。
+"""
+from functools import lru_cache
+
+from startup import lazy_import
+
+np = lazy_import("numpy")
+
+# 单元格均值是浮点数，默认使用 65536 级精度
+LEVELS = 65536
+
+
+def add_lut_args(parser, gamma=1.0, skip_darkest=0):
+    parser.add_argument("--gamma", type=float, default=gamma,
+                        help="gamma applied to normalized brightness before picking a character")
+    parser.add_argument("--skip_darkest", type=int, default=skip_darkest,
+                        help="number of darkest characters never used")
+    return parser
+
+
+@lru_cache(maxsize=64)
+def build_lut(num_chars, gamma=1.0, skip_darkest=0, levels=LEVELS):
+    """
+    返回 levels 个条目的只读数组
+
+    map_cells 把灰度 g 放入第 int(g * (levels - 1) / 255) 个区间，表项取区间右端（不含）处的映射，
+    这样恰好落在字符分界上的灰度（整数像素的均值很常见）与直接计算的结果一致。
+    """
+    skip_darkest = min(max(skip_darkest, 0), num_chars - 1)
+    usable = num_chars - skip_darkest
+    brightness = np.minimum((np.arange(levels) + 1 - 1e-6) / (levels - 1), 1.0) ** gamma
+    lut = skip_darkest + np.minimum((brightness * usable).astype(np.int32), usable - 1)
+    lut.flags.writeable = False
+    return lut
+
+
+def map_cells(cell_grays, num_chars, gamma=1.0, skip_darkest=0, levels=LEVELS):
+    """把 (rows, cols) 的灰度均值（0-255）映射为字符索引"""
+    lut = build_lut(num_chars, gamma, skip_darkest, levels)
+    positions = np.clip(cell_grays, 0, 255) * ((levels - 1) / 255.0)
+    return np.take(lut, positions.astype(np.intp))
@@ -0,0 +1,103 @@
+"""
+按字形结构选择字符
+
+每个字形的覆盖率蒙版缩小为 grid_rows x grid_cols 的网格；每个单元格按同样的网格取子块均值。
+色调沿用 map_cells 的映射（暗处使用笔画多的字符），形状决定在色调相近的字形中选哪一个：
+单元格得分 = 形状与字形形状（归一化）的内积 - 色调偏差的惩罚，整张网格只需一次矩阵乘法。
+"""
+from functools import lru_cache
+
+from glyph_lut import map_cells
+from startup import lazy_import
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+
+MATCH_MODES = ["brightness", "structure"]
+
+# 每次矩阵乘法处理的单元格数，限制 (单元格数, 字符数) 得分矩阵的内存
+CHUNK_SIZE = 65536
+
+# 色调每偏离一个字符间距的惩罚；越大越接近按亮度映射，越小越偏重形状
+TONE_WEIGHT = 0.01
+
+
+def add_match_args(parser):
+    parser.add_argument("--match", type=str, default="brightness", choices=MATCH_MODES,
+                        help="pick characters by mean brightness or by shape similarity")
+    parser.add_argument("--match_grid", type=int, default=4,
+                        help="descriptor columns per character in structure mode (rows follow the cell aspect)")
+    return parser
+
+
+class GlyphMatcher:
+    """保存图集中每个字形的形状和覆盖率，为单元格选择字符"""
+
+    def __init__(self, atlas, grid_cols=4):
+        num_chars, tile_height, tile_width = atlas.tiles.shape
+        self.grid_cols = max(1, int(grid_cols))
+        self.grid_rows = max(1, int(round(self.grid_cols * tile_height / max(tile_width, 1))))
+        grids = [cv2.resize(tile, (self.grid_cols, self.grid_rows), interpolation=cv2.INTER_AREA)
+                 for tile in atlas.tiles]
+        grids = np.stack(grids).reshape(num_chars, -1).astype(np.float32) / 255
+        # 每个字形的平均覆盖率，以及按覆盖率从密到疏排列的字形索引（与 map_cells 的索引方向一致）
+        self.coverage = grids.mean(axis=1)
+        self.order = np.argsort(-self.coverage, kind="stable")
+        self.contrast = float(self.coverage.max() - self.coverage.min())
+        # 去均值并归一化的形状，(字符数, 描述维度)；空白等没有起伏的字形形状为 0
+        shapes = grids - self.coverage[:, None]
+        norms = np.linalg.norm(shapes, axis=1, keepdims=True)
+        shapes = np.divide(shapes, norms, out=np.zeros_like(shapes), where=norms > 1e-6)
+        # -w (t - c)^2 去掉与字形无关的 t^2 后为 2wtc - wc^2，把 2wc 拼到形状后面与单元格的 t 相乘
+        step = max(self.contrast, 1e-6) / num_chars
+        weight = np.float32(TONE_WEIGHT / step ** 2)
+        self.weights = np.hstack([shapes, 2 * weight * self.coverage[:, None]])
+        self.offsets = weight * np.square(self.coverage)
+
+    def patches(self, gray, ys, xs, gamma=1.0, skip_darkest=0):
+        """
+        把灰度图按单元格边界 ys、xs 划分，每个单元格缩放为描述网格
+
+        返回 (rows, cols, 描述维度 + 1) 的数组：单元格内的明暗起伏（取反为墨量，按字形覆盖率范围缩放）
+        以及目标覆盖率：按 map_cells 的映射在按覆盖率排序的字形中取值，字符集已按亮度排序时
+        与按亮度映射的色调相同。
+        """
+        num_rows, num_cols = len(ys) - 1, len(xs) - 1
+        region = gray[ys[0]:ys[-1], xs[0]:xs[-1]]
+        size = (num_cols * self.grid_cols, num_rows * self.grid_rows)
+        # INTER_AREA 缩小时取区域均值；单元格小于描述网格时退化为插值
+        resized = cv2.resize(region, size, interpolation=cv2.INTER_AREA).astype(np.float32) / 255
+        resized = resized.reshape(num_rows, self.grid_rows, num_cols, self.grid_cols).transpose(0, 2, 1, 3)
+        resized = resized.reshape(num_rows, num_cols, -1)
+        means = resized.mean(axis=2, keepdims=True)
+        tones = self.coverage[self.order]
+        tone = tones[map_cells(means[:, :, 0] * 255, len(tones), gamma, skip_darkest)]
+        shape = (means - resized) * self.contrast
+        return np.concatenate([shape, tone[:, :, None]], axis=2)
+
+    def match(self, patches, skip_darkest=0):
+        """为 patches 的每个单元格选择得分最高的字符，返回 (rows, cols) 的字符索引"""
+        skip_darkest = min(max(skip_darkest, 0), len(self.weights) - 1)
+        # 跳过覆盖率最高的 skip_darkest 个字形
+        candidates = self.order[skip_darkest:]
+        weights = self.weights[candidates]
+        offsets = self.offsets[candidates]
+        flat = patches.reshape(-1, patches.shape[-1])
+        result = np.empty(len(flat), dtype=np.intp)
+        for start in range(0, len(flat), CHUNK_SIZE):
+            scores = flat[start:start + CHUNK_SIZE] @ weights.T
+            scores -= offsets
+            result[start:start + CHUNK_SIZE] = scores.argmax(axis=1)
+        return candidates[result].reshape(patches.shape[:2])
+
+
+@lru_cache(maxsize=32)
+def get_matcher(atlas, grid_cols=4):
+    """按 (图集, 描述网格) 缓存匹配器"""
+    return GlyphMatcher(atlas, grid_cols)
+
+
+def match_cells(gray, ys, xs, atlas, grid_cols=4, gamma=1.0, skip_darkest=0):
+    """按字形结构为灰度图的每个单元格选择字符，返回 (rows, cols) 的字符索引"""
+    matcher = get_matcher(atlas, grid_cols)
+    return matcher.match(matcher.patches(gray, ys, xs, gamma, skip_darkest), skip_darkest)
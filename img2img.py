@@ -3,16 +3,69 @@
 """
 import argparse
 import os
-import cv2
-import numpy as np
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+import sys
+import tempfile
+from dataclasses import dataclass
+from io import BytesIO
+from animation import AnimationWriter, add_animation_args, frame_count, is_animation, read_frames
+from ascii_daemon import add_daemon_args, forward
+from cell_stats import cell_bounds, grid_means
+from font_registry import find_font
+from glyph_atlas import get_atlas
+from glyph_lut import add_lut_args, map_cells
+from glyph_match import add_match_args, match_cells
+from palette import add_palette_args, build_palette, savable, save_image
+from png_stream import PngWriter
+from stage_timer import add_profile_args, count, profiled, stage
+from startup import add_startup_args, lazy_import, startup_profile
 from utils import get_data
 
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+ImageOps = lazy_import("PIL.ImageOps")
 
-def get_args():
-    parser = argparse.ArgumentParser("Image to ASCII")
-    parser.add_argument("--input", type=str, default="data/input.jpg", help="Path to input image")
-    parser.add_argument("--output", type=str, default="data/output.jpg", help="Path to output image file")
+# 缩小解码后每个单元格至少保留的源像素宽度
+MIN_CELL_PIXELS = 4
+
+# (灰度, 缩小倍数) -> OpenCV 的缩小解码标志名，JPEG 由 libjpeg 直接按比例解码
+_REDUCED_FLAGS = {
+    (False, 2): "IMREAD_REDUCED_COLOR_2",
+    (False, 4): "IMREAD_REDUCED_COLOR_4",
+    (False, 8): "IMREAD_REDUCED_COLOR_8",
+    (True, 2): "IMREAD_REDUCED_GRAYSCALE_2",
+    (True, 4): "IMREAD_REDUCED_GRAYSCALE_4",
+    (True, 8): "IMREAD_REDUCED_GRAYSCALE_8",
+}
+
+# EXIF 方向标签；取值 5-8 表示图片需要旋转 90 度显示，OpenCV 解码时会按它旋转
+_EXIF_ORIENTATION = 0x0112
+
+
+@dataclass
+class AsciiOptions:
+    """与命令行参数同名的转换参数，供库调用（例如 API）使用"""
+    language: str = "english"
+    custom_text: str = ""
+    mode: str = "standard"
+    background: str = "black"
+    num_cols: int = 300
+    color: bool = False
+    portrait: bool = False
+    gamma: float = 0.6
+    skip_darkest: int = 1
+    match: str = "brightness"
+    match_grid: int = 4
+    full_decode: bool = False
+    palette: str = "none"
+    palette_size: int = 256
+    kmeans_iterations: int = 4
+    quiet: bool = False
+
+
+def add_style_args(parser):
+    """添加与输入输出路径无关的参数，供批量转换等入口复用"""
     parser.add_argument("--language", type=str, default="english", 
                         help="Character set language (english, chinese, etc.) or 'custom' for custom text")
     parser.add_argument("--custom_text", type=str, default="",
@@ -24,17 +77,34 @@ def get_args():
     parser.add_argument("--num_cols", type=int, default=300, help="number of character for output's width")
     parser.add_argument("--color", action="store_true", help="Enable color output")
     parser.add_argument("--portrait", action="store_true", help="Optimize for portrait orientation (vertical images)")
-    args = parser.parse_args()
+    add_lut_args(parser, gamma=0.6, skip_darkest=1)
+    add_match_args(parser)
+    add_palette_args(parser)
+    parser.add_argument("--full_decode", action="store_true",
+                        help="Always decode JPEG inputs at full resolution")
+    add_animation_args(parser)
+    parser.add_argument("--quiet", action="store_true",
+                        help="Only print warnings and errors (no debug, save or memory messages)")
+    return parser
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser("Image to ASCII")
+    parser.add_argument("--input", type=str, default="data/input.jpg", help="Path to input image")
+    parser.add_argument("--output", type=str, default="data/output.jpg", help="Path to output image file")
+    parser.add_argument("--tile_rows", type=int, default=0,
+                        help="process the image in bands of this many character rows (0: whole image); bounds the memory "
+                             "of statistics, rendering and output, but the decoded input is still held in full")
+    add_style_args(parser)
+    add_profile_args(parser)
+    add_startup_args(parser)
+    add_daemon_args(parser)
+    args = parser.parse_args(argv)
     return args
 
 
-def main(opt):
-    # 设置背景色
-    if opt.background == "white":
-        bg_code = 255
-    else:
-        bg_code = 0
-    
+def load_charset(opt):
+    """加载字符集和字体，返回 (char_list, font, sample_character, scale)"""
     # 处理自定义文本
     if opt.custom_text:
         # 使用自定义文本作为字符集
@@ -46,91 +116,99 @@ def main(opt):
             char_list = "江雪利"  # 默认值
             
         # 打印调试信息
-        print(f"使用的字符集: {char_list}")
+        if not opt.quiet:
+            print(f"使用的字符集: {char_list}")
         
-        # 设置中文字体
-        def find_compatible_font(font_size=24):
-            import platform
-            sys_platform = platform.system().lower()
-            font_candidates = []
-            # 优先级：用户常见字体
-            if sys_platform == "darwin":  # macOS
-                font_candidates = [
-                    "/System/Library/Fonts/PingFang.ttc",
-                    "/System/Library/Fonts/STHeiti Light.ttc",
-                    "/System/Library/Fonts/Hiragino Sans GB W3.ttc",
-                ]
-            elif sys_platform == "windows":
-                font_candidates = [
-                    "C:/Windows/Fonts/msyh.ttc",  # 微软雅黑
-                    "C:/Windows/Fonts/simhei.ttf", # 黑体
-                    "C:/Windows/Fonts/simsun.ttc", # 宋体
-                ]
-            else:  # Linux & 其他
-                font_candidates = [
-                    "/usr/share/fonts/chinese/simsun.ttf",  # 优先 simsun.ttf
-                    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-                    "/usr/share/fonts/truetype/arphic/ukai.ttc",
-                    "/usr/share/fonts/truetype/arphic/uming.ttc",
-                    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
-                    "/usr/share/fonts/truetype/wqy/wqy-microhei.ttc",
-                    "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf",
-                ]
-            for font_path in font_candidates:
-                print(f"检测字体路径: {font_path} exists={os.path.exists(font_path)}")
-                if os.path.exists(font_path):
-                    try:
-                        font = ImageFont.truetype(font_path, font_size)
-                        print(f"使用字体: {font_path}")
-                        return font
-                    except Exception as e:
-                        print(f"加载字体 {font_path} 失败: {repr(e)}")
-                        continue
-            print("警告: 未找到合适的中文字体，将使用默认字体，可能无法正确显示中文字符")
-            return ImageFont.load_default()
-
-        try:
-            font_size = 24
-            font = find_compatible_font(font_size)
+        # 设置中文字体：从字体注册表中选择能显示全部字符的字体
+        font_size = 24
+        font = find_font(char_list, font_size)
+        if not opt.quiet:
             print(f"字体大小: {getattr(font, 'size', font_size)}")
             print(f"支持的字符: {char_list}")
-        except Exception as e:
-            print(f"加载中文字体失败: {e}")
-            print("将使用默认字体，但可能无法正确显示中文字符")
-            font = ImageFont.load_default()
         
         # 设置字符属性
         sample_character = char_list[0] if char_list else "A"
         scale = 1.5  # 调整行高比例
-        num_chars = len(set(char_list))  # 去重后的字符数量
     else:
         # 使用预定义的字符集
         char_list, font, sample_character, scale = get_data(opt.language, opt.mode)
+    return char_list, font, sample_character, scale
+
+
+def convert(image, opt, charset=None, crop=True):
+    """把 BGR 图片数组转换为ASCII艺术图片，返回 PIL Image；crop 为假时不裁掉四周的背景"""
+    # 设置背景色
+    if opt.background == "white":
+        bg_code = 255
+    else:
+        bg_code = 0
     
-    num_chars = len(set(char_list))  # 使用唯一字符数量
-    num_cols = opt.num_cols
+    # 字符集可以由调用方预先加载（例如批量转换时每个进程只加载一次）
+    if charset is None:
+        charset = load_charset(opt)
+    char_list, font, sample_character, scale = charset
     
-    # 读取图片
-    image = cv2.imread(opt.input)
-    if image is None:
-        raise ValueError(f"无法加载图片: {opt.input}")
+    num_chars = len(set(char_list))  # 使用唯一字符数量
     
-    # 转换为RGB颜色空间
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    # 彩色模式转换为RGB颜色空间，否则转换为灰度图
+    with stage("stats"):
+        image = prepare_image(image, opt)
     height, width = image.shape[:2]
     
-    # 如果不是彩色模式，转换为灰度图
-    if not opt.color:
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    
     # 计算单元格大小和行列数
-    if opt.portrait and width > height:
-        # 如果是横屏图片但启用了竖屏模式，则旋转图片
-        image_rgb = cv2.rotate(image_rgb, cv2.ROTATE_90_CLOCKWISE)
-        if not opt.color:
-            image = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
-        height, width = image_rgb.shape[:2]
+    cell_width, cell_height, num_cols, num_rows = grid_size(height, width, opt, scale)
+    char_width, row_height = glyph_size(font, sample_character, scale)
+    
+    # 一次性计算所有单元格的统计值
+    ys = cell_bounds(height, cell_height, num_rows)
+    xs = cell_bounds(width, cell_width, num_cols)
+    # 字形图集同时用于结构匹配和渲染
+    atlas = get_atlas(font, char_list, char_width, row_height)
+    char_indices, cell_colors, cell_grays = map_band(image, ys, xs, opt, atlas, num_chars)
+    # 调色板模式只用于彩色输出（灰度输出本身就只有 256 级）
+    with stage("select"):
+        palette = build_palette(opt, (bg_code, bg_code, bg_code), cell_colors) if opt.color else None
+    
+    # 打印调试信息（只打印图像中心区域的信息）
+    if not opt.quiet:
+        center = (num_rows // 2, num_cols // 2)
+        print(f"原始灰度值: {cell_grays[center]:.1f}")
+        print(f"处理后灰度值: {cell_grays[center]:.1f}, 字符索引: {char_indices[center]}")
     
+    with stage("render"):
+        out_image = render_band(atlas, char_indices, cell_colors, opt, bg_code, palette)
+        if palette is not None:
+            out_image = palette.image(out_image)
+        else:
+            out_image = Image.fromarray(out_image, "RGB" if opt.color else "L")
+        
+        # 裁剪图片
+        if opt.background == "white" and not opt.color:
+            cropped_image = ImageOps.invert(out_image).getbbox()
+        else:
+            cropped_image = out_image.getbbox()
+        
+        if crop and cropped_image:  # 确保有内容可以裁剪
+            out_image = out_image.crop(cropped_image)
+    return out_image
+
+
+def prepare_image(image, opt, rotate=True):
+    """BGR 图片在彩色模式下转换为 RGB，否则转换为灰度（已是灰度图时不变）；rotate 时竖屏模式下旋转横屏图片"""
+    if opt.color:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    elif image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    height, width = image.shape[:2]
+    if rotate and opt.portrait and width > height:
+        # 如果是横屏图片但启用了竖屏模式，则旋转图片
+        image = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    return image
+
+
+def grid_size(height, width, opt, scale):
+    """返回 (cell_width, cell_height, num_cols, num_rows)"""
+    num_cols = opt.num_cols
     cell_width = width / opt.num_cols
     cell_height = scale * cell_width
     num_rows = int(height / cell_height)
@@ -141,109 +219,303 @@ def main(opt):
         cell_height = 12
         num_cols = int(width / cell_width)
         num_rows = int(height / cell_height)
-    
+    return cell_width, cell_height, num_cols, num_rows
+
+
+def glyph_size(font, sample_character, scale):
+    """返回输出中每个字符的 (宽度, 行高)"""
     # 创建一个临时图片来获取字符大小
     temp_img = Image.new('L', (100, 100), 255)
     draw = ImageDraw.Draw(temp_img)
     bbox = draw.textbbox((0, 0), sample_character, font=font)
     char_width, char_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
     
-    # 创建输出图片
-    out_width = char_width * num_cols
-    out_height = int(scale * char_height * num_rows)
+    # 每行的高度（包含行距）
+    row_height = int(round(scale * char_height))
+    return char_width, row_height
+
+
+def map_band(image, ys, xs, opt, atlas, num_chars, first_row=0):
+    """
+    为 image 上由边界 ys、xs 划分的单元格选择字符
+
+    image 为 prepare_image 的结果，可以只是整张图片的一段（ys 相对于这一段，first_row 为这一段第一行的行号）。
+    返回 (char_indices, cell_colors, cell_grays)，灰度模式下 cell_colors 为 None。
+    """
+    num_rows, num_cols = len(ys) - 1, len(xs) - 1
+    count("cells", num_rows * num_cols)
+    cell_colors = None
+    with stage("stats"):
+        if opt.color:
+            # 彩色模式：每个单元格的平均颜色
+            cell_colors = grid_means(image, ys, xs).astype(int)
+            # 使用亮度公式计算灰度值
+            cell_grays = cell_colors @ np.array([0.299, 0.587, 0.114])
+        else:
+            # 灰度模式
+            cell_grays = grid_means(image, ys, xs)
     
+    # 将灰度值映射到字符索引
+    with stage("select"):
+        if opt.custom_text:
+            # 对于自定义文本，直接根据位置循环使用字符
+            positions = np.arange(first_row * num_cols, (first_row + num_rows) * num_cols)
+            char_indices = positions.reshape(num_rows, num_cols) % len(atlas.char_list)
+        elif opt.match == "structure":
+            # 按字形结构匹配：比较单元格内的明暗分布与字形的笔画分布
+            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY) if opt.color else image
+            char_indices = match_cells(gray, ys, xs, atlas, opt.match_grid, opt.gamma, opt.skip_darkest)
+        else:
+            # 对于预定义字符集，通过查找表映射（默认 gamma 0.6，跳过最暗的字符）
+            char_indices = map_cells(cell_grays, num_chars, opt.gamma, opt.skip_darkest)
+    return char_indices, cell_colors, cell_grays
+
+
+def render_band(atlas, char_indices, cell_colors, opt, bg_code, palette=None):
+    """使用字形图集一次性渲染所有字符，返回 uint8 数组；传入 palette 时返回调色板索引图"""
+    count("glyphs", char_indices.size)
+    if opt.portrait:
+        # 竖排文字（从上到下，从右到左）
+        char_indices = char_indices[:, ::-1]
+        if opt.color:
+            cell_colors = cell_colors[:, ::-1]
+    if palette is not None:
+        return atlas.render_indexed(char_indices, palette.index(cell_colors))
     if opt.color:
-        out_image = Image.new("RGB", (out_width, out_height), (bg_code, bg_code, bg_code))
+        return atlas.render(char_indices, (bg_code, bg_code, bg_code), colors=cell_colors)
+    return atlas.render(char_indices, bg_code, foreground=255 - bg_code)
+
+
+def decode_factor(width, height, opt):
+    """返回缩小解码的倍数（1、2、4 或 8）：取每个单元格仍至少有 MIN_CELL_PIXELS 个源像素宽的最大倍数"""
+    if opt.full_decode:
+        return 1
+    # 竖屏模式会把横屏图片旋转，列沿原图的高度方向排列
+    span = height if opt.portrait and width > height else width
+    min_cell = MIN_CELL_PIXELS
+    if opt.match == "structure":
+        min_cell = max(min_cell, opt.match_grid)
+    for factor in (8, 4, 2):
+        if span / factor / opt.num_cols >= min_cell:
+            return factor
+    return 1
+
+
+def load_image(source, opt, grayscale=False):
+    """
+    解码图片路径或编码后的字节，返回 BGR（grayscale 时为灰度）数组，无法解码时返回 None
+
+    JPEG 图片在网格远比原图粗时按 decode_factor 直接解码为缩小的图片，省去完整解码的时间和内存。
+    """
+    try:
+        with Image.open(source if isinstance(source, str) else BytesIO(source)) as header:
+            image_format, (width, height) = header.format, header.size
+            # 按解码后（已按 EXIF 方向旋转）的宽高选择缩小倍数
+            if header.getexif().get(_EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+                width, height = height, width
+    except Exception:
+        image_format, width, height = None, 0, 0
+    factor = decode_factor(width, height, opt) if image_format == "JPEG" else 1
+    if factor > 1:
+        flag = getattr(cv2, _REDUCED_FLAGS[(grayscale, factor)])
     else:
-        out_image = Image.new("L", (out_width, out_height), bg_code)
+        flag = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    if isinstance(source, str):
+        return cv2.imread(source, flag)
+    return cv2.imdecode(np.frombuffer(source, dtype=np.uint8), flag)
+
+
+def convert_bytes(data, opt, image_format="JPEG", charset=None):
+    """
+    在内存中完成转换：输入为编码后的图片字节或 BGR 数组，返回编码后的输出图片字节
+    """
+    if isinstance(data, np.ndarray):
+        image = data
+    else:
+        with stage("decode"):
+            image = load_image(data, opt)
+        if image is None:
+            raise ValueError("无法解码图片")
+    out_image = convert(image, opt, charset)
+    with stage("encode"):
+        buffer = BytesIO()
+        savable(out_image, image_format).save(buffer, format=image_format, quality=95)
+    count("bytes_written", buffer.tell())
+    return buffer.getvalue()
+
+
+def convert_tiled(image, opt, output, tile_rows, charset=None):
+    """
+    按 tile_rows 个字符行一段处理图片并写出
+
+    只有输出一侧的内存随段高变化：颜色转换、积分图和渲染结果都只针对当前这一段，
+    而输入图片仍然整张解码在内存中（JPEG 可按 decode_factor 缩小解码，灰度模式只保留单通道）。
+    渲染结果先顺序写入临时文件，确定裁剪范围后再逐段写入输出：PNG 输出全程按段写入，
+    其他格式需要在内存中组装裁剪后的整张图片。
+    image 为 BGR 或灰度数组。灰度模式下 main 直接读入灰度图以省去彩色副本，解码器的灰度转换
+    与 convert 中的 cvtColor 略有差别，因此结果可能与 convert 有细微的灰度差异。
+    """
+    if opt.background == "white":
+        bg_code = 255
+    else:
+        bg_code = 0
+    if charset is None:
+        charset = load_charset(opt)
+    char_list, font, sample_character, scale = charset
+    num_chars = len(set(char_list))
+    
+    # 只在竖屏模式需要旋转时复制整张图片；颜色转换推迟到每一段
+    height, width = image.shape[:2]
+    if opt.portrait and width > height:
+        image = cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+        height, width = image.shape[:2]
     
-    draw = ImageDraw.Draw(out_image)
+    cell_width, cell_height, num_cols, num_rows = grid_size(height, width, opt, scale)
+    char_width, row_height = glyph_size(font, sample_character, scale)
+    ys = cell_bounds(height, cell_height, num_rows)
+    xs = cell_bounds(width, cell_width, num_cols)
+    atlas = get_atlas(font, char_list, char_width, row_height)
     
-    # 处理每一行
-    for i in range(num_rows):
-        y_start = int(i * cell_height)
-        y_end = min(int((i + 1) * cell_height), height)
+    channels = 3 if opt.color else 1
+    out_width = num_cols * char_width
+    row_bytes = out_width * channels
+    # 与 convert 的裁剪规则一致：白底灰度图按非白色像素裁剪，其余按非零像素裁剪
+    ink_value = 255 if opt.background == "white" and not opt.color else 0
+    top, bottom, left, right = None, 0, out_width, 0
+    with tempfile.TemporaryFile() as raw:
+        for first_row in range(0, num_rows, tile_rows):
+            last_row = min(first_row + tile_rows, num_rows)
+            band_ys = ys[first_row:last_row + 1]
+            with stage("stats"):
+                band = prepare_image(image[band_ys[0]:band_ys[-1]], opt, rotate=False)
+            char_indices, cell_colors, _ = map_band(band, band_ys - band_ys[0], xs, opt, atlas, num_chars, first_row)
+            with stage("render"):
+                out_band = render_band(atlas, char_indices, cell_colors, opt, bg_code)
+                ink = out_band != ink_value
+                if ink.ndim == 3:
+                    ink = ink.any(axis=2)
+                ink_rows = np.flatnonzero(ink.any(axis=1))
+                ink_cols = np.flatnonzero(ink.any(axis=0))
+            if len(ink_rows):
+                offset = first_row * row_height
+                top = offset + ink_rows[0] if top is None else top
+                bottom = offset + ink_rows[-1] + 1
+                left = min(left, ink_cols[0])
+                right = max(right, ink_cols[-1] + 1)
+            with stage("encode"):
+                raw.write(out_band.tobytes())
+        if top is None:
+            # 没有任何内容时不裁剪
+            top, bottom, left, right = 0, num_rows * row_height, 0, out_width
         
-        for j in range(num_cols):
-            x_start = int(j * cell_width)
-            x_end = min(int((j + 1) * cell_width), width)
-            
-            # 获取当前单元格区域
-            if opt.color:
-                # 彩色模式：获取平均颜色
-                region = image_rgb[y_start:y_end, x_start:x_end]
-                if region.size > 0:
-                    # 使用中值减少噪声
-                    avg_color = np.median(region, axis=(0, 1)).astype(int)
-                    # 使用亮度公式计算灰度值
-                    r, g, b = avg_color
-                    gray = 0.299 * r + 0.587 * g + 0.114 * b
-                    avg_color = tuple(avg_color)
-                else:
-                    avg_color = (bg_code, bg_code, bg_code)
-                    gray = bg_code
-            else:
-                # 灰度模式
-                region = image[y_start:y_end, x_start:x_end]
-                gray = np.mean(region) if region.size > 0 else bg_code
-            
-            # 打印调试信息
-            if i == num_rows // 2 and j == num_cols // 2:  # 只打印图像中心区域的信息
-                print(f"原始灰度值: {gray:.1f}")
-                
-            # 1. 确保灰度值在有效范围内
-            normalized_gray = min(1.0, max(0.0, gray / 255.0))
-            
-            # 2. 将灰度值映射到字符索引
-            # 使用灰度值在字符集中循环选择字符
-            if opt.custom_text:
-                # 对于自定义文本，直接根据位置循环使用字符
-                char_idx = (i * num_cols + j) % len(char_list)
-            else:
-                # 对于预定义字符集，使用灰度值映射
-                gamma = 0.6
-                normalized_gray = normalized_gray ** gamma
-                min_char_idx = 1  # 跳过最暗的字符
-                max_char_idx = num_chars - 1
-                char_range = max_char_idx - min_char_idx
-                char_idx = min_char_idx + int(normalized_gray * char_range)
-                char_idx = min(max_char_idx, max(min_char_idx, char_idx))
-            
-            if i == num_rows // 2 and j == num_cols // 2:  # 只打印图像中心区域的信息
-                print(f"处理后灰度值: {gray:.1f}, 字符索引: {char_idx}")
-            char = char_list[char_idx]
-            
-            # 计算绘制位置
-            if opt.portrait:
-                # 竖排文字（从上到下，从右到左）
-                x = out_width - (j + 1) * char_width
-                y = i * char_height * scale
-            else:
-                # 横排文字（从左到右，从上到下）
-                x = j * char_width
-                y = i * char_height * scale
-            
-            # 绘制字符
-            if opt.color and region.size > 0:
-                draw.text((x, y), char, fill=tuple(avg_color), font=font)
+        def read_rows(start, stop):
+            raw.seek(start * row_bytes)
+            rows = np.frombuffer(raw.read((stop - start) * row_bytes), dtype=np.uint8)
+            rows = rows.reshape(stop - start, out_width, channels)[:, left:right]
+            return rows if opt.color else rows[:, :, 0]
+        
+        band_height = tile_rows * row_height
+        with stage("encode"):
+            if os.path.splitext(output)[1].lower() == ".png":
+                with PngWriter(output, right - left, bottom - top, channels) as writer:
+                    for start in range(top, bottom, band_height):
+                        writer.write_rows(read_rows(start, min(start + band_height, bottom)))
             else:
-                fill_color = 255 - bg_code if region.size > 0 else bg_code
-                draw.text((x, y), char, fill=fill_color, font=font)
-    
-    # 裁剪图片
-    if opt.background == "white" and not opt.color:
-        cropped_image = ImageOps.invert(out_image).getbbox()
+                Image.fromarray(read_rows(top, bottom), "RGB" if opt.color else "L").save(output, quality=95)
+    count("bytes_written", os.path.getsize(output))
+
+
+def convert_animation(opt, charset=None):
+    """
+    把动画图片（GIF、APNG 等）逐帧转换后写成 GIF 或 APNG 动画（见 animation），保留每帧的显示时长
+
+    逐帧解码、转换和写入；为了让每帧尺寸一致，输出不裁剪四周的背景。
+    """
+    if charset is None:
+        charset = load_charset(opt)
+    frames = read_frames(opt.input)
+    writer = None
+    num_frames = 0
+    try:
+        while True:
+            with stage("decode"):
+                item = next(frames, None)
+            if item is None:
+                break
+            image, duration = item
+            out_image = convert(image, opt, charset, crop=False)
+            with stage("encode"):
+                frame = np.asarray(out_image.convert("RGB"))[:, :, ::-1]
+                if writer is None:
+                    writer = AnimationWriter(opt.output, 0, frame, opt)
+                writer.write(frame, duration)
+            num_frames += 1
+            if writer.done:
+                break
+    finally:
+        frames.close()
+        if writer is not None:
+            with stage("encode"):
+                writer.release()
+    if writer is None:
+        raise ValueError(f"无法加载图片: {opt.input}")
+    count("frames", num_frames)
+    count("bytes_written", os.path.getsize(opt.output))
+    print(f"Converted {num_frames} frames into {writer.frames_written} animation frames")
+
+
+def peak_memory_mb():
+    """返回进程的峰值常驻内存（MB），平台不支持时返回 None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 上单位为 KB，macOS 上为字节
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def main(opt, charset=None):
+    if opt.tile_rows > 0 and opt.color and opt.palette != "none":
+        # 调色板需要整张网格的颜色，索引图也不能按段写入
+        print("Palette mode converts the whole image, ignoring --tile_rows")
+        opt.tile_rows = 0
+    if is_animation(opt.output) and frame_count(opt.input) > 1:
+        # 多帧输入且输出为 GIF、APNG 时输出动画
+        convert_animation(opt, charset)
+    elif opt.tile_rows > 0:
+        # 分段模式：灰度输出时直接读入灰度图
+        with stage("decode"):
+            image = load_image(opt.input, opt, grayscale=not opt.color)
+        if image is None:
+            raise ValueError(f"无法加载图片: {opt.input}")
+        convert_tiled(image, opt, opt.output, opt.tile_rows, charset)
     else:
-        cropped_image = out_image.getbbox()
-    
-    if cropped_image:  # 确保有内容可以裁剪
-        out_image = out_image.crop(cropped_image)
-    
-    # 保存图片
-    out_image.save(opt.output, quality=95)
+        # 读取图片
+        with stage("decode"):
+            image = load_image(opt.input, opt)
+        if image is None:
+            raise ValueError(f"无法加载图片: {opt.input}")
+        
+        out_image = convert(image, opt, charset)
+        
+        # 保存图片
+        with stage("encode"):
+            save_image(out_image, opt.output, quality=95)
+        count("bytes_written", os.path.getsize(opt.output))
+    if opt.quiet:
+        return
     print(f"Image saved to {opt.output}")
+    peak = peak_memory_mb()
+    if peak is not None:
+        print(f"Peak memory: {peak:.1f} MB")
 
 
 if __name__ == '__main__':
+    # 守护进程在运行时由它转换（见 ascii_daemon），否则在本进程中转换
+    forward('img2img')
     opt = get_args()
-    main(opt)
+    with startup_profile(opt), profiled(opt):
+        main(opt)
@@ -2,14 +2,25 @@
 @author: Viet Nguyen <nhviet1009@gmail.com>
 """
 import argparse
+import os
 
-import cv2
-import numpy as np
-from PIL import Image, ImageDraw, ImageOps
+from ascii_daemon import add_daemon_args, forward
+from cell_stats import cell_bounds, cell_gray, grid_means
+from glyph_atlas import get_atlas
+from glyph_lut import add_lut_args, map_cells
+from glyph_match import add_match_args, match_cells
+from palette import add_palette_args, build_palette, save_image
+from stage_timer import add_profile_args, count, profiled, stage
+from startup import add_startup_args, lazy_import, startup_profile
 from utils import get_data
 
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+ImageOps = lazy_import("PIL.ImageOps")
 
-def get_args():
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser("Image to ASCII")
     parser.add_argument("--input", type=str, default="data/input.jpg", help="Path to input image")
     parser.add_argument("--output", type=str, default="data/output.jpg", help="Path to output text file")
@@ -19,7 +30,13 @@ def get_args():
                         help="background's color")
     parser.add_argument("--num_cols", type=int, default=300, help="number of character for output's width")
     parser.add_argument("--scale", type=int, default=2, help="upsize output")
-    args = parser.parse_args()
+    add_lut_args(parser)
+    add_match_args(parser)
+    add_palette_args(parser)
+    add_profile_args(parser)
+    add_startup_args(parser)
+    add_daemon_args(parser)
+    args = parser.parse_args(argv)
     return args
 
 
@@ -31,8 +48,10 @@ def main(opt):
     char_list, font, sample_character, scale = get_data(opt.language, opt.mode)
     num_chars = len(char_list)
     num_cols = opt.num_cols
-    image = cv2.imread(opt.input, cv2.IMREAD_COLOR)
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    with stage("decode"):
+        image = cv2.imread(opt.input, cv2.IMREAD_COLOR)
+    with stage("stats"):
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     height, width, _ = image.shape
     cell_width = width / opt.num_cols
     cell_height = scale * cell_width
@@ -43,28 +62,45 @@ def main(opt):
         cell_height = 12
         num_cols = int(width / cell_width)
         num_rows = int(height / cell_height)
-    char_width, char_height = font.getsize(sample_character)
-    out_width = char_width * num_cols
-    out_height = scale * char_height * num_rows
-    out_image = Image.new("RGB", (out_width, out_height), bg_code)
-    draw = ImageDraw.Draw(out_image)
-    for i in range(num_rows):
-        for j in range(num_cols):
-            partial_image = image[int(i * cell_height):min(int((i + 1) * cell_height), height),
-                            int(j * cell_width):min(int((j + 1) * cell_width), width), :]
-            partial_avg_color = np.sum(np.sum(partial_image, axis=0), axis=0) / (cell_height * cell_width)
-            partial_avg_color = tuple(partial_avg_color.astype(np.int32).tolist())
-            char = char_list[min(int(np.mean(partial_image) * num_chars / 255), num_chars - 1)]
-            draw.text((j * char_width, i * char_height), char, fill=partial_avg_color, font=font)
+    # 行高使用字体的 ascent + descent，保证下伸部分（g、y 等）不会被单元格截断
+    char_width = font.getbbox(sample_character)[2]
+    char_height = sum(font.getmetrics())
+    ys = cell_bounds(height, cell_height, num_rows)
+    xs = cell_bounds(width, cell_width, num_cols)
+    count("cells", num_rows * num_cols)
+    with stage("stats"):
+        cell_colors = grid_means(image, ys, xs)
+    atlas = get_atlas(font, char_list, char_width, char_height)
+    with stage("select"):
+        if opt.match == "structure":
+            gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+            char_indices = match_cells(gray, ys, xs, atlas, opt.match_grid, opt.gamma, opt.skip_darkest)
+        else:
+            cell_grays = cell_gray(cell_colors)
+            char_indices = map_cells(cell_grays, num_chars, opt.gamma, opt.skip_darkest)
+    count("glyphs", char_indices.size)
+    with stage("select"):
+        palette = build_palette(opt, bg_code, cell_colors)
+    with stage("render"):
+        if palette is not None:
+            out_image = palette.image(atlas.render_indexed(char_indices, palette.index(cell_colors)))
+        else:
+            out_image = atlas.render(char_indices, bg_code, colors=cell_colors.astype(np.int32))
+            out_image = Image.fromarray(out_image, "RGB")
 
-    if opt.background == "white":
-        cropped_image = ImageOps.invert(out_image).getbbox()
-    else:
-        cropped_image = out_image.getbbox()
-    out_image = out_image.crop(cropped_image)
-    out_image.save(opt.output)
+        if opt.background == "white":
+            cropped_image = ImageOps.invert(out_image).getbbox()
+        else:
+            cropped_image = out_image.getbbox()
+        out_image = out_image.crop(cropped_image)
+    with stage("encode"):
+        save_image(out_image, opt.output)
+    count("bytes_written", os.path.getsize(opt.output))
 
 
 if __name__ == '__main__':
+    # 守护进程在运行时由它转换（见 ascii_daemon），否则在本进程中转换
+    forward('img2img_color')
     opt = get_args()
-    main(opt)
+    with startup_profile(opt), profiled(opt):
+        main(opt)
@@ -2,12 +2,21 @@
 @author: Viet Nguyen <nhviet1009@gmail.com>
 """
 import argparse
+import os
+import sys
 
-import cv2
-import numpy as np
+from ansi import colorize_grid, quantize
+from ascii_daemon import add_daemon_args, forward
+from cell_stats import cell_means, cell_gray
+from glyph_lut import add_lut_args, map_cells
+from stage_timer import add_profile_args, count, profiled, stage
+from startup import add_startup_args, lazy_import, startup_profile
 
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
 
-def get_args():
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser("Image to ASCII")
     parser.add_argument("--input", type=str, default="data/input.jpg", help="Path to input image")
     parser.add_argument("--output", type=str, default="data/output.txt", help="Path to output text file")
@@ -15,9 +24,15 @@ def get_args():
                         help="10 or 70 different characters")
     parser.add_argument("--num_cols", type=int, default=80, help="number of character for output's width")
     parser.add_argument("--color", action="store_true", help="Enable color output (only works when outputting to terminal)")
+    parser.add_argument("--color_step", type=int, default=1,
+                        help="quantization step per color channel, larger values merge more color runs")
     parser.add_argument("--output_image", type=str, help="Save as a colored image (e.g., output.png)")
     parser.add_argument("--font_size", type=int, default=10, help="Font size for output image")
-    args = parser.parse_args()
+    add_lut_args(parser)
+    add_profile_args(parser)
+    add_startup_args(parser)
+    add_daemon_args(parser)
+    args = parser.parse_args(argv)
     return args
 
 
@@ -30,17 +45,11 @@ def main(opt):
     num_cols = opt.num_cols
     
     # 读取图片并转换颜色空间
-    image = cv2.imread(opt.input)
+    with stage("decode"):
+        image = cv2.imread(opt.input)
     if image is None:
         raise ValueError(f"无法加载图片: {opt.input}")
-        
-    # 转换颜色空间
-    image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
     height, width = image.shape[:2]
-    
-    # 如果是灰度模式，转换为灰度图
-    if not (opt.color or opt.output_image):
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     cell_width = width / opt.num_cols
     cell_height = 2 * cell_width
     num_rows = int(height / cell_height)
@@ -51,92 +60,73 @@ def main(opt):
         num_cols = int(width / cell_width)
         num_rows = int(height / cell_height)
 
-    # 准备输出
-    output = []
-    color_data = []
-    
-    for i in range(num_rows):
-        line = ""
-        line_colors = []
-        for j in range(num_cols):
-            # 获取当前字符区域
-            y_start = int(i * cell_height)
-            y_end = min(int((i + 1) * cell_height), height)
-            x_start = int(j * cell_width)
-            x_end = min(int((j + 1) * cell_width), width)
-            
-            if opt.color or opt.output_image:
-                # 计算平均颜色
-                region = image_rgb[y_start:y_end, x_start:x_end]
-                avg_color = np.mean(region, axis=(0, 1)).astype(int)
-                r, g, b = avg_color
-                
-                # 计算灰度值用于选择字符
-                gray = np.mean(region) if len(region) > 0 else 0
-                char = CHAR_LIST[min(int(gray * num_chars / 255), num_chars - 1)]
-                
-                # 保存颜色信息
-                line_colors.append((r, g, b))
-                
-                # 添加ANSI颜色代码（仅当输出到终端时）
-                if opt.color and not opt.output_image:
-                    line += f"\033[38;2;{r};{g};{b}m{char}"
-                else:
-                    line += char
-            else:
-                # 灰度模式
-                region = image[y_start:y_end, x_start:x_end]
-                gray = np.mean(region) if len(region) > 0 else 0
-                char = CHAR_LIST[min(int(gray * num_chars / 255), num_chars - 1)]
-                line += char
-        
+    # 一次性计算所有单元格的平均值（彩色模式转换为RGB，灰度模式转换为灰度图）
+    count("cells", num_rows * num_cols)
+    with stage("stats"):
+        if opt.color or opt.output_image:
+            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            cell_colors = cell_means(image_rgb, cell_width, cell_height, num_cols, num_rows)
+            cell_grays = cell_gray(cell_colors)
+            cell_colors = cell_colors.astype(int)
+        else:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            cell_grays = cell_means(image, cell_width, cell_height, num_cols, num_rows)
+    with stage("select"):
+        char_indices = map_cells(cell_grays, num_chars, opt.gamma, opt.skip_darkest)
+
+    with stage("render"):
+        # 整张网格一次查表得到字符
+        chars = np.frombuffer(CHAR_LIST.encode("ascii"), dtype=np.uint8)[char_indices]
         if opt.color and not opt.output_image:
-            line += "\033[0m"  # 重置颜色
-        output.append(line + "\n")
-        if opt.output_image:
-            color_data.append(line_colors)
+            # 添加ANSI颜色代码（仅当输出到终端时），相邻同色字符只输出一次转义序列
+            text = colorize_grid(chars, quantize(cell_colors, opt.color_step), opt.color_step).decode("ascii")
+        else:
+            # 每行末尾加换行符后整体解码为文本
+            grid = np.empty((num_rows, num_cols + 1), dtype=np.uint8)
+            grid[:, :num_cols] = chars
+            grid[:, num_cols] = ord("\n")
+            text = grid.tobytes().decode("ascii")
     
     # 保存为图片
     if opt.output_image:
-        from PIL import Image, ImageDraw, ImageFont
-        import os
+        from PIL import Image
+        from font_registry import MONO_FONTS, find_font
+        from glyph_atlas import get_atlas
         
-        # 计算图片尺寸
+        # 计算字符尺寸
         font_size = opt.font_size
-        font = ImageFont.truetype("Arial.ttf" if os.name == 'nt' else "/System/Library/Fonts/Menlo.ttc", 
-                                 font_size)
-        char_width = font.getlength('M')  # 使用'M'作为参考字符
-        char_height = font_size * 1.2  # 添加一些行间距
-        
-        # 创建新图片
-        img_width = int(num_cols * char_width)
-        img_height = int(num_rows * char_height)
-        img = Image.new('RGB', (img_width, img_height), color='black')
-        draw = ImageDraw.Draw(img)
-        
-        # 绘制文字
-        for i, (line, colors) in enumerate(zip(output, color_data)):
-            y = i * char_height
-            for j, ((r, g, b), char) in enumerate(zip(colors, line.strip())):
-                x = j * char_width
-                draw.text((x, y), char, fill=(r, g, b), font=font)
+        font = find_font(CHAR_LIST, font_size, tuple(MONO_FONTS))
+        char_width = int(round(font.getlength('M')))  # 使用'M'作为参考字符
+        char_height = int(round(font_size * 1.2))  # 添加一些行间距
         
-        # 保存图片
-        img.save(opt.output_image)
+        # 使用字形图集一次性渲染所有字符
+        atlas = get_atlas(font, CHAR_LIST, char_width, char_height)
+        count("glyphs", char_indices.size)
+        with stage("render"):
+            img = atlas.render(char_indices, (0, 0, 0), colors=cell_colors)
+        with stage("encode"):
+            Image.fromarray(img, "RGB").save(opt.output_image)
+        count("bytes_written", os.path.getsize(opt.output_image))
         print(f"Color ASCII art saved to {opt.output_image}")
     
     # 写入文本文件
     if opt.output:
-        with open(opt.output, 'w', encoding='utf-8') as f:
-            f.writelines(output)
+        with stage("encode"), open(opt.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+        count("bytes_written", len(text))
     
     # 如果输出到终端，直接打印结果
     if opt.output != '/dev/stdout' and not opt.output_image:
-        print(''.join(output), end='')
+        sys.stdout.write(text)
+        count("bytes_written", len(text))
+        sys.stdout.flush()
     elif opt.output_image:
         print(f"Text output saved to {opt.output}" if opt.output else "")
 
 
 if __name__ == '__main__':
+    # 守护进程在运行时由它转换（见 ascii_daemon），否则在本进程中转换
+    forward('img2txt')
     opt = get_args()
-    main(opt)
+    with startup_profile(opt), profiled(opt):
+        main(opt)
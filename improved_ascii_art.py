@@ -3,41 +3,53 @@
 使用更精细的字符集和图像处理来生成更好的效果
 """
 import argparse
-import cv2
-import numpy as np
-from PIL import Image, ImageDraw, ImageFont
+import os
+from ascii_daemon import add_daemon_args, forward
+from glyph_lut import add_lut_args, map_cells
+from stage_timer import add_profile_args, count, profiled, stage
+from startup import add_startup_args, lazy_import, startup_profile
 
-def get_args():
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+ImageFont = lazy_import("PIL.ImageFont")
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser("Improved ASCII Art Generator")
     parser.add_argument("--input", type=str, default="demo/input.jpg", help="输入图片路径")
     parser.add_argument("--output", type=str, default="demo/improved_art.jpg", help="输出图片路径")
     parser.add_argument("--width", type=int, default=150, help="输出宽度（字符数）")
     parser.add_argument("--invert", action="store_true", help="反转颜色（黑底白字）")
-    return parser.parse_args()
+    add_lut_args(parser)
+    add_profile_args(parser)
+    add_startup_args(parser)
+    add_daemon_args(parser)
+    return parser.parse_args(argv)
 
-def main():
-    args = get_args()
-    
+def main(args):
     # 读取图片
     try:
-        img = cv2.imread(args.input)
+        with stage("decode"):
+            img = cv2.imread(args.input)
         if img is None:
             raise Exception("无法读取图片")
         
-        # 转换为灰度图并调整对比度
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # 调整对比度
-        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
-        gray = clahe.apply(gray)
-        
-        # 调整大小
-        height, width = gray.shape
-        aspect_ratio = width / height
-        new_width = args.width
-        new_height = int(new_width / aspect_ratio * 0.5)  # 修正字符的宽高比
-        
-        resized = cv2.resize(gray, (new_width, new_height))
+        with stage("stats"):
+            # 转换为灰度图并调整对比度
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            
+            # 调整对比度
+            clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8,8))
+            gray = clahe.apply(gray)
+            
+            # 调整大小
+            height, width = gray.shape
+            aspect_ratio = width / height
+            new_width = args.width
+            new_height = int(new_width / aspect_ratio * 0.5)  # 修正字符的宽高比
+            
+            resized = cv2.resize(gray, (new_width, new_height))
         
         # 定义字符集（从最暗到最亮）
         chars = "@%#*+=-:. "
@@ -54,26 +66,35 @@ def main():
         output_img = Image.new('RGB', (output_width, output_height), color='white' if not args.invert else 'black')
         draw = ImageDraw.Draw(output_img)
         
+        # 将每个像素的亮度映射到字符集
+        count("cells", new_width * new_height)
+        with stage("select"):
+            char_indices = map_cells(resized, len(chars), args.gamma, args.skip_darkest)
+        
         # 生成ASCII艺术
-        for i in range(new_height):
-            for j in range(new_width):
-                # 获取当前像素的亮度
-                pixel = resized[i, j]
-                # 将亮度映射到字符集
-                char_index = int((pixel / 255) * (len(chars) - 1))
-                char = chars[char_index]
-                # 绘制字符
-                x = j * char_width
-                y = i * char_height
-                fill_color = (0, 0, 0) if not args.invert else (255, 255, 255)
-                draw.text((x, y), char, fill=fill_color, font=font)
+        fill_color = (0, 0, 0) if not args.invert else (255, 255, 255)
+        count("glyphs", new_width * new_height)
+        with stage("render"):
+            for i in range(new_height):
+                for j in range(new_width):
+                    char = chars[char_indices[i, j]]
+                    # 绘制字符
+                    x = j * char_width
+                    y = i * char_height
+                    draw.text((x, y), char, fill=fill_color, font=font)
         
         # 保存图片
-        output_img.save(args.output)
+        with stage("encode"):
+            output_img.save(args.output)
+        count("bytes_written", os.path.getsize(args.output))
         print(f"ASCII艺术图片已保存到: {args.output}")
         
     except Exception as e:
         print(f"发生错误: {str(e)}")
 
 if __name__ == "__main__":
-    main()
+    # 守护进程在运行时由它转换（见 ascii_daemon），否则在本进程中转换
+    forward("improved_ascii_art")
+    opt = get_args()
+    with startup_profile(opt), profiled(opt):
+        main(opt)
@@ -0,0 +1,93 @@
+"""
+进程内的 Prometheus 指标
+
+支持计数器、仪表和直方图，render() 输出 Prometheus 文本格式（version 0.0.4），
+不依赖 prometheus_client。
+"""
+import threading
+
+# 秒为单位的默认直方图分桶
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join('{}="{}"'.format(name, value) for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """指标注册表，先用 counter/gauge/histogram 声明，再用 inc/set/observe 更新"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 名称 -> (类型, 说明, 直方图分桶)
+        self._meta = {}
+        # 名称 -> {标签元组: 值}；直方图的值为 [各分桶计数..., 总和, 次数]
+        self._values = {}
+
+    def counter(self, name, help_text):
+        self._declare(name, "counter", help_text)
+
+    def gauge(self, name, help_text):
+        self._declare(name, "gauge", help_text)
+
+    def histogram(self, name, help_text, buckets=DURATION_BUCKETS):
+        self._declare(name, "histogram", help_text, tuple(buckets))
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[name][key] = value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        buckets = self._meta[name][2]
+        with self._lock:
+            series = self._values[name]
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * (len(buckets) + 2)
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in self._meta.items():
+                lines.append("# HELP {} {}".format(name, help_text))
+                lines.append("# TYPE {} {}".format(name, kind))
+                for labels, value in self._values[name].items():
+                    if kind != "histogram":
+                        lines.append("{}{} {}".format(name, _format_labels(labels), _format_value(value)))
+                        continue
+                    for bound, bucket_count in zip(buckets + (float("inf"),), value[:-2] + [value[-1]]):
+                        bucket_labels = labels + (("le", _format_value(bound)),)
+                        lines.append("{}_bucket{} {}".format(name, _format_labels(bucket_labels), bucket_count))
+                    lines.append("{}_sum{} {}".format(name, _format_labels(labels), _format_value(value[-2])))
+                    lines.append("{}_count{} {}".format(name, _format_labels(labels), value[-1]))
+        return "\n".join(lines) + "\n"
+
+    def _declare(self, name, kind, help_text, buckets=()):
+        with self._lock:
+            if name not in self._meta:
+                self._meta[name] = (kind, help_text, buckets)
+                self._values[name] = {}
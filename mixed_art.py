@@ -6,6 +6,7 @@ import argparse
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
+from font_registry import find_font
 
 def get_args():
     parser = argparse.ArgumentParser("Mixed Character ASCII Art")
@@ -47,6 +48,8 @@ def main():
         font_size = 10
         font = ImageFont.load_default()
         char_width, char_height = 6, 12  # 默认字体大小
+        # 中文字符使用更大的中文字体
+        large_font = find_font(chinese_chars, font_size * 2)
         
         output_width = char_width * new_width
         output_height = char_height * new_height
@@ -69,12 +72,7 @@ def main():
                     char_index = int((pixel / 255) * (len(chinese_chars) - 1))
                     char = chinese_chars[char_index]
                     # 使用更大的字体突出显示中文字符
-                    try:
-                        large_font = ImageFont.truetype("PingFang.ttc", font_size*2)
-                        draw.text((j*char_width, i*char_height), char, fill="black", font=large_font)
-                    except:
-                        # 如果找不到中文字体，使用默认字体
-                        draw.text((j*char_width, i*char_height), char, fill="black", font=font)
+                    draw.text((j*char_width, i*char_height), char, fill="black", font=large_font)
                 else:
                     # 使用英文字符
                     char_index = int((pixel / 255) * (len(chars) - 1))
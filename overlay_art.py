@@ -6,6 +6,7 @@ import argparse
 import cv2
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont, ImageOps
+from font_registry import find_font
 
 def get_args():
     parser = argparse.ArgumentParser("Overlay ASCII Art")
@@ -73,18 +74,9 @@ def main():
         for i, line in enumerate(ascii_art):
             draw.text((0, i * char_height), line, fill="black", font=font)
         
-        # 添加"刘德华"文字
-        try:
-            # 尝试使用中文字体
-            chinese_font = ImageFont.truetype("PingFang.ttc", 80)
-        except:
-            try:
-                chinese_font = ImageFont.truetype("Arial Unicode.ttf", 80)
-            except:
-                chinese_font = ImageFont.load_default()
-        
         # 在图片中心添加"刘德华"
         text = "刘 德 华"
+        chinese_font = find_font(text, 80)
         # 使用 textbbox 替代 getsize
         left, top, right, bottom = chinese_font.getbbox(text)
         text_width = right - left
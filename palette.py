@@ -0,0 +1,181 @@
+"""
+调色板模式：把每个单元格的颜色量化到最多 256 种颜色，输出为索引（P 模式）图片
+
+- fixed：均匀的颜色立方体（256 色时每通道 6 级，共 216 色），量化只是逐通道取整；
+  最小的立方体（每通道 2 级）加背景需要 9 色，更小的 --palette_size 改用 adaptive
+- adaptive：对单元格颜色网格做中位切分（median-cut），再用加权 k-means 迭代修正
+
+调色板的 0 号颜色固定为背景色，渲染时字形覆盖率不低于一半的像素取单元格的颜色索引，其余为 0，
+即纯粹的查表，不做抗锯齿混合。索引图保存为 PNG、GIF 等格式时文件比 RGB 输出小数倍。
+"""
+from startup import lazy_import
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+
+PALETTES = ["none", "fixed", "adaptive"]
+# 可以直接保存索引图片的扩展名，其他格式（如 JPEG）保存前转换为 RGB
+INDEXED_EXTENSIONS = (".png", ".gif", ".bmp", ".tif", ".tiff")
+INDEXED_FORMATS = ("PNG", "GIF", "BMP", "TIFF")
+
+# fixed 调色板最小的颜色立方体（每通道 2 级）加背景色的颜色数
+MIN_FIXED_SIZE = 9
+# 计算最近颜色时每批的单元格数，限制距离矩阵的内存
+_CHUNK = 65536
+
+
+def add_palette_args(parser):
+    parser.add_argument("--palette", type=str, default="none", choices=PALETTES,
+                        help="quantize cell colors to a fixed color cube or an adaptive palette and render an "
+                             "indexed image (color output only)")
+    parser.add_argument("--palette_size", type=int, default=256,
+                        help="number of palette entries including the background (2-256; fixed needs at least 9, "
+                             "smaller sizes use the adaptive palette)")
+    parser.add_argument("--kmeans_iterations", type=int, default=4,
+                        help="k-means refinement passes after median-cut for the adaptive palette")
+    return parser
+
+
+class Palette:
+    """
+    colors 为 (n, 3) 的 uint8 数组，0 号为背景色；levels 不为 None 时 1 号之后是每通道 levels 级的颜色立方体
+
+    颜色的通道顺序与传入的单元格颜色一致（图片为 RGB，视频帧为 BGR）。
+    """
+
+    def __init__(self, colors, levels=None):
+        self.colors = np.asarray(colors, dtype=np.uint8)
+        self.levels = levels
+
+    def index(self, cell_colors):
+        """返回每个单元格颜色在调色板中的索引（uint8，不会是背景的 0 号）"""
+        cell_colors = np.asarray(cell_colors)
+        if self.levels is not None:
+            # 均匀立方体中最近的颜色就是逐通道四舍五入到最近的一级
+            steps = (cell_colors.astype(np.int32) * (self.levels - 1) + 127) // 255
+            indices = (steps[..., 0] * self.levels + steps[..., 1]) * self.levels + steps[..., 2]
+            return (indices + 1).astype(np.uint8)
+        flat = cell_colors.reshape(-1, 3).astype(np.float32)
+        indices = nearest(flat, self.colors[1:].astype(np.float32)) + 1
+        return indices.astype(np.uint8).reshape(cell_colors.shape[:-1])
+
+    def lookup(self, indices, out=None):
+        """把索引图转换为颜色数组；传入 out 时结果写入 out"""
+        return np.take(self.colors, indices, axis=0, out=out)
+
+    def image(self, indices):
+        """把 (H, W) 的索引数组转换为 P 模式的 PIL 图片（颜色须为 RGB 顺序）"""
+        image = Image.fromarray(indices, "P")
+        image.putpalette(self.colors.tobytes())
+        return image
+
+
+def nearest(colors, palette):
+    """返回 colors (n, 3) 中每个颜色在 palette (k, 3) 中最近颜色的下标，距离用矩阵乘法按批计算"""
+    palette_norms = (palette ** 2).sum(axis=1)
+    result = np.empty(len(colors), dtype=np.intp)
+    for start in range(0, len(colors), _CHUNK):
+        chunk = colors[start:start + _CHUNK]
+        # |c - p|^2 = |c|^2 - 2 c·p + |p|^2，其中 |c|^2 对所有 p 相同可以省略
+        distances = palette_norms - 2 * chunk @ palette.T
+        result[start:start + _CHUNK] = distances.argmin(axis=1)
+    return result
+
+
+def fixed_palette(background, size=256):
+    """背景色加上每通道 levels 级的均匀颜色立方体（levels ** 3 不超过 size - 1，size 至少为 MIN_FIXED_SIZE）"""
+    levels = 2
+    while (levels + 1) ** 3 <= size - 1:
+        levels += 1
+    steps = np.round(np.arange(levels) * 255 / (levels - 1)).astype(np.uint8)
+    cube = np.stack(np.meshgrid(steps, steps, steps, indexing="ij"), axis=-1).reshape(-1, 3)
+    return Palette(np.vstack([np.asarray(background, dtype=np.uint8)[None], cube]), levels)
+
+
+def median_cut(colors, weights, size):
+    """把带权重的颜色按中位切分分成最多 size 组，返回每组的加权平均颜色 (k, 3) 和总权重"""
+    boxes = [np.arange(len(colors))]
+    spans = [np.ptp(colors, axis=0)]
+    widths = [float(spans[0].max())]
+    while len(boxes) < size:
+        # 切分颜色范围最大的一组，沿范围最大的通道在加权中位数处切开
+        widest = max(range(len(widths)), key=widths.__getitem__)
+        if widths[widest] == 0:
+            break
+        box = boxes.pop(widest)
+        axis = int(np.argmax(spans.pop(widest)))
+        widths.pop(widest)
+        box = box[np.argsort(colors[box, axis], kind="stable")]
+        cumulative = np.cumsum(weights[box])
+        split = int(np.searchsorted(cumulative, cumulative[-1] / 2))
+        split = min(max(split, 1), len(box) - 1)
+        for part in (box[:split], box[split:]):
+            part_colors = colors[part]
+            span = part_colors.max(axis=0) - part_colors.min(axis=0)
+            boxes.append(part)
+            spans.append(span)
+            widths.append(float(span.max()))
+    labels = np.empty(len(colors), dtype=np.intp)
+    for label, box in enumerate(boxes):
+        labels[box] = label
+    return _weighted_means(colors, weights, labels, len(boxes))
+
+
+def _weighted_means(colors, weights, labels, size):
+    """按 labels 分组的加权平均颜色 (size, 3)，以及每组的总权重"""
+    totals = np.bincount(labels, weights=weights, minlength=size)
+    sums = np.stack([np.bincount(labels, weights=weights * colors[:, channel], minlength=size)
+                     for channel in range(3)], axis=1)
+    return sums / np.maximum(totals, 1e-12)[:, None], totals
+
+
+def kmeans(colors, weights, centers, iterations):
+    """从 centers 开始做 iterations 次加权 k-means（Lloyd）迭代，没有分到颜色的中心保持不变"""
+    for _ in range(iterations):
+        means, totals = _weighted_means(colors, weights, nearest(colors, centers), len(centers))
+        used = totals > 0
+        centers[used] = means[used]
+    return centers
+
+
+def adaptive_palette(cell_colors, background, size=256, iterations=4):
+    """根据单元格颜色网格生成背景色加最多 size - 1 种颜色的调色板"""
+    # 相同的颜色只计算一次，出现次数作为权重
+    colors, counts = np.unique(np.asarray(cell_colors).reshape(-1, 3).astype(np.uint8), axis=0,
+                               return_counts=True)
+    colors = colors.astype(np.float32)
+    weights = counts.astype(np.float64)
+    if len(colors) <= size - 1:
+        centers = colors
+    else:
+        centers = kmeans(colors, weights, median_cut(colors, weights, size - 1)[0].astype(np.float32), iterations)
+    centers = np.clip(np.round(centers), 0, 255).astype(np.uint8)
+    return Palette(np.vstack([np.asarray(background, dtype=np.uint8)[None], centers]))
+
+
+def build_palette(opt, background, cell_colors=None):
+    """
+    按 opt.palette 生成调色板，为 none 时返回 None；adaptive 调色板需要单元格颜色
+
+    fixed 的颜色数小于 MIN_FIXED_SIZE 时放不下颜色立方体，改用 adaptive 以保证不超过 palette_size。
+    """
+    if opt.palette == "none":
+        return None
+    size = min(max(opt.palette_size, 2), 256)
+    if opt.palette == "fixed" and size >= MIN_FIXED_SIZE:
+        return fixed_palette(background, size)
+    return adaptive_palette(cell_colors, background, size, opt.kmeans_iterations)
+
+
+def savable(image, image_format):
+    """image_format 不能保存索引图片时把 P 模式图片转换为 RGB"""
+    if image.mode == "P" and (image_format or "").upper() not in INDEXED_FORMATS:
+        return image.convert("RGB")
+    return image
+
+
+def save_image(image, path, **params):
+    """保存图片，扩展名不支持索引图片时先转换为 RGB"""
+    if image.mode == "P" and not path.lower().endswith(INDEXED_EXTENSIONS):
+        image = image.convert("RGB")
+    image.save(path, **params)
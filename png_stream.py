@@ -0,0 +1,133 @@
+"""
+逐行写出 PNG 文件，不需要在内存中保存整张图片；ApngWriter 逐帧写出调色板动画（APNG）
+"""
+import struct
+import zlib
+
+from startup import lazy_import
+
+np = lazy_import("numpy")
+
+_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG 颜色类型：0 为灰度，2 为 RGB，3 为调色板
+_COLOR_TYPES = {1: 0, 3: 2}
+_PALETTE_COLOR_TYPE = 3
+
+
+class PngWriter:
+    """
+    按从上到下的顺序写入 uint8 行块，行块为 (rows, width) 的灰度或 (rows, width, 3) 的 RGB 数组
+
+    用法：
+        with PngWriter(path, width, height, channels) as writer:
+            writer.write_rows(rows)
+    """
+
+    def __init__(self, path, width, height, channels=1, level=6):
+        if channels not in _COLOR_TYPES:
+            raise ValueError("仅支持灰度或 RGB 图片")
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.rows_written = 0
+        self._compressor = zlib.compressobj(level)
+        self._file = open(path, "wb")
+        self._file.write(_SIGNATURE)
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, _COLOR_TYPES[channels], 0, 0, 0))
+
+    def write_rows(self, rows):
+        rows = np.ascontiguousarray(rows, dtype=np.uint8).reshape(len(rows), self.width * self.channels)
+        if self.rows_written + len(rows) > self.height:
+            raise ValueError("写入的行数超过图片高度")
+        # 每行前加一个滤波类型字节（0：不滤波）
+        data = np.hstack([np.zeros((len(rows), 1), dtype=np.uint8), rows])
+        compressed = self._compressor.compress(data.tobytes())
+        if compressed:
+            self._chunk(b"IDAT", compressed)
+        self.rows_written += len(rows)
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if self.rows_written != self.height:
+                raise ValueError("只写入了 {} / {} 行".format(self.rows_written, self.height))
+            self._chunk(b"IDAT", self._compressor.flush())
+            self._chunk(b"IEND", b"")
+        finally:
+            self._file.close()
+
+    def _chunk(self, kind, data):
+        self._file.write(struct.pack(">I", len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+
+class ApngWriter(PngWriter):
+    """
+    逐帧写入调色板索引图的 APNG 动画，帧可以只是画面中的一个矩形区域（叠加在上一帧之上）
+
+    用法：
+        with ApngWriter(path, width, height, palette) as writer:
+            writer.write_frame(indices, x, y, duration_ms)
+
+    第一帧必须覆盖整个画面。帧数在写完后才知道，close 时回到文件开头改写 acTL 块。
+    """
+
+    def __init__(self, path, width, height, palette, loop=0, level=6):
+        self.width = width
+        self.height = height
+        self.level = level
+        self.frames_written = 0
+        self._sequence = 0
+        self._file = open(path, "wb")
+        self._file.write(_SIGNATURE)
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, _PALETTE_COLOR_TYPE, 0, 0, 0))
+        self._chunk(b"PLTE", np.ascontiguousarray(palette, dtype=np.uint8).tobytes())
+        self._loop = loop
+        self._actl_offset = self._file.tell()
+        self._chunk(b"acTL", struct.pack(">II", 0, loop))
+
+    def write_frame(self, indices, x, y, duration):
+        """写入一帧：indices 为 (rows, cols) 的 uint8 索引图，放在画面的 (x, y) 处，显示 duration 毫秒"""
+        indices = np.ascontiguousarray(indices, dtype=np.uint8)
+        rows, cols = indices.shape
+        if self.frames_written == 0 and (x, y, cols, rows) != (0, 0, self.width, self.height):
+            raise ValueError("第一帧必须覆盖整个画面")
+        # 延迟为 duration / 1000 秒；dispose_op 0（保留）、blend_op 0（覆盖）
+        self._chunk(b"fcTL", struct.pack(">IIIIIHHBB", self._next_sequence(), cols, rows, x, y,
+                                         min(int(round(duration)), 65535), 1000, 0, 0))
+        data = np.hstack([np.zeros((rows, 1), dtype=np.uint8), indices])
+        compressed = zlib.compress(data.tobytes(), self.level)
+        if self.frames_written == 0:
+            self._chunk(b"IDAT", compressed)
+        else:
+            self._chunk(b"fdAT", struct.pack(">I", self._next_sequence()) + compressed)
+        self.frames_written += 1
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if self.frames_written == 0:
+                raise ValueError("没有写入任何帧")
+            self._chunk(b"IEND", b"")
+            self._file.seek(self._actl_offset)
+            self._chunk(b"acTL", struct.pack(">II", self.frames_written, self._loop))
+        finally:
+            self._file.close()
+
+    def _next_sequence(self):
+        sequence = self._sequence
+        self._sequence += 1
+        return sequence
@@ -0,0 +1,117 @@
+"""
+生成结果的内容寻址缓存
+
+键为上传图片字节与规范化转换参数的哈希。内存层按字节数上限做 LRU 淘汰，
+可选的磁盘层按总大小淘汰最久未使用的文件。
+"""
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from dataclasses import asdict
+
+
+def cache_key(content, options, image_format):
+    """根据图片内容、转换参数和输出格式计算缓存键"""
+    normalized = asdict(options)
+    normalized["language"] = normalized["language"].lower()
+    normalized["image_format"] = image_format.upper()
+    digest = hashlib.sha256(content)
+    digest.update(json.dumps(normalized, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(self, max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "disk_evictions": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(disk_dir) if entry.is_file())
+
+    def get(self, key):
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.stats["hits"] += 1
+            return data
+        data = self._disk_get(key)
+        if data is not None:
+            self.stats["disk_hits"] += 1
+            self._memory_put(key, data)
+            return data
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key, data):
+        self._memory_put(key, data)
+        self._disk_put(key, data)
+
+    def info(self):
+        return dict(self.stats, entries=len(self._memory), bytes=self._memory_bytes, disk_bytes=self._disk_bytes)
+
+    def _memory_put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.stats["evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key)
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # 更新修改时间，淘汰时按它判断最近使用
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def _disk_put(self, key, data):
+        if not self.disk_dir or len(data) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print("Failed to write result cache {}: {}".format(path, e))
+            return
+        self._disk_bytes += len(data)
+        if self._disk_bytes > self.disk_max_bytes:
+            self._disk_evict()
+
+    def _disk_evict(self):
+        entries = sorted((entry for entry in os.scandir(self.disk_dir) if entry.is_file()),
+                         key=lambda entry: entry.stat().st_mtime)
+        self._disk_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self._disk_bytes <= self.disk_max_bytes:
+                break
+            try:
+                size = entry.stat().st_size
+                os.unlink(entry.path)
+            except OSError:
+                continue
+            self._disk_bytes -= size
+            self.stats["disk_evictions"] += 1
@@ -0,0 +1,89 @@
+"""
+转换阶段计时和计数
+
+转换器用 with stage("stats"): ... 包住各个阶段，用 count("cells", n) 累加计数；调用方在
+with collect() as profile: 块内运行转换，得到当前线程各阶段的累计耗时（秒）和各项计数。
+没有调用方收集时 stage 和 count 几乎没有开销。
+
+命令行脚本加上 --profile（或设置环境变量 ASCII_PROFILE=1）后，在标准错误输出中打印统计结果。
+"""
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# 解码、单元格统计、选择字符、渲染、编码输出
+STAGES = ["decode", "stats", "select", "render", "encode"]
+
+# 处理的单元格数、绘制的字形数、写出的字节数、视频帧数
+COUNTERS = ["cells", "glyphs", "bytes_written", "frames"]
+
+PROFILE_ENV = "ASCII_PROFILE"
+
+_local = threading.local()
+
+
+class Profile:
+    """一次或多次转换的阶段耗时（秒）和计数"""
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+
+    def summary(self):
+        lines = ["{:<14}{:>10.1f} ms".format(name, seconds * 1000) for name, seconds in self.stages.items()]
+        lines += ["{:<14}{:>10d}".format(name, value) for name, value in self.counters.items()]
+        return "\n".join(lines)
+
+
+@contextmanager
+def stage(name):
+    profile = getattr(_local, "profile", None)
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.stages[name] = profile.stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def count(name, value=1):
+    profile = getattr(_local, "profile", None)
+    if profile is not None:
+        profile.counters[name] = profile.counters.get(name, 0) + int(value)
+
+
+@contextmanager
+def collect():
+    """在 with 块内收集当前线程的阶段耗时和计数，产出 Profile"""
+    previous = getattr(_local, "profile", None)
+    profile = Profile()
+    _local.profile = profile
+    try:
+        yield profile
+    finally:
+        _local.profile = previous
+
+
+def add_profile_args(parser):
+    parser.add_argument("--profile", action="store_true",
+                        help="print per-stage timings and counters to stderr (or set {}=1)".format(PROFILE_ENV))
+    return parser
+
+
+def profile_enabled(opt=None):
+    return bool(getattr(opt, "profile", False)) or os.environ.get(PROFILE_ENV, "") not in ("", "0")
+
+
+@contextmanager
+def profiled(opt=None):
+    """开启统计时收集 with 块内的阶段耗时和计数，结束后打印到标准错误输出"""
+    if not profile_enabled(opt):
+        yield None
+        return
+    with collect() as profile:
+        yield profile
+    print(profile.summary(), file=sys.stderr)
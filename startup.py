@@ -0,0 +1,89 @@
+"""
+启动耗时：延迟导入和导入耗时分析
+
+- lazy_import(name)：返回模块的占位对象，第一次访问属性时才真正导入，
+  命令行脚本只有在用到 OpenCV、NumPy、Pillow 的代码路径上才付出导入时间（--help、参数错误等不会导入）
+- --startup-profile：在标准错误输出中打印各模块的导入耗时，以及开始转换前、转换本身的耗时
+
+本模块只依赖标准库。命令行带有 --startup-profile 时，导入本模块即开始记录之后的所有导入，
+因此入口脚本应尽早导入本模块；解释器自身启动（site 等）的耗时可用 python -X importtime 查看。
+"""
+import builtins
+import sys
+import time
+import types
+from contextlib import contextmanager
+
+STARTUP_FLAG = "--startup-profile"
+
+_start = time.perf_counter()
+# 顶层导入语句 -> 首次导入的累计耗时（秒，包含其依赖）
+_import_times = {}
+_depth = 0
+
+
+class _LazyModule(types.ModuleType):
+    """第一次访问属性时导入真正的模块，并把模块属性复制到自身，之后的访问与普通模块相同"""
+
+    def __getattr__(self, attr):
+        name = self.__name__
+        __import__(name)
+        module = sys.modules[name]
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    """返回模块 name（已导入时直接返回模块本身，否则返回延迟导入的占位对象）"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return _LazyModule(name)
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    global _depth
+    if level or _depth or name in sys.modules:
+        _depth += 1
+        try:
+            return _original_import(name, globals, locals, fromlist, level)
+        finally:
+            _depth -= 1
+    _depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _depth -= 1
+        _import_times[name] = _import_times.get(name, 0.0) + time.perf_counter() - start
+
+
+_original_import = builtins.__import__
+if STARTUP_FLAG in sys.argv:
+    builtins.__import__ = _timed_import
+
+
+def add_startup_args(parser):
+    parser.add_argument(STARTUP_FLAG, dest="startup_profile", action="store_true",
+                        help="print import times and time spent before and during conversion to stderr")
+    return parser
+
+
+@contextmanager
+def startup_profile(opt):
+    """opt.startup_profile 为真时，with 块（转换）结束后打印导入耗时分析"""
+    if not getattr(opt, "startup_profile", False):
+        yield
+        return
+    ready = time.perf_counter()
+    imports_before = sum(_import_times.values())
+    yield
+    done = time.perf_counter()
+    print("{:<32}{:>10.1f} ms".format("before main", (ready - _start) * 1000), file=sys.stderr)
+    print("{:<32}{:>10.1f} ms".format("  imports", imports_before * 1000), file=sys.stderr)
+    print("{:<32}{:>10.1f} ms".format("main", (done - ready) * 1000), file=sys.stderr)
+    print("{:<32}{:>10.1f} ms".format("  imports", (sum(_import_times.values()) - imports_before) * 1000),
+          file=sys.stderr)
+    print("slowest imports (including their dependencies):", file=sys.stderr)
+    for name, seconds in sorted(_import_times.items(), key=lambda item: -item[1])[:15]:
+        print("  {:<30}{:>10.1f} ms".format(name, seconds * 1000), file=sys.stderr)
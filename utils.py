@@ -1,8 +1,23 @@
-import numpy as np
-from PIL import Image, ImageFont, ImageDraw, ImageOps
+from font_registry import get_font
+from glyph_cache import get_ranking
+from startup import lazy_import
+
+np = lazy_import("numpy")
+Image = lazy_import("PIL.Image")
+ImageDraw = lazy_import("PIL.ImageDraw")
+ImageOps = lazy_import("PIL.ImageOps")
+
+LANGUAGES = ["english", "german", "french", "italian", "polish", "portuguese", "spanish", "russian", "chinese",
+             "korean", "japanese"]
 
 
 def sort_chars(char_list, font, language):
+    result, _ = get_ranking(char_list, font, language, lambda: rank_chars(char_list, font, language))
+    return result
+
+
+def rank_chars(char_list, font, language):
+    """按亮度排序字符，返回 (排序后的字符串, 每个字符的亮度列表)"""
     # 创建一个临时图片来获取字符大小
     temp_img = Image.new('L', (100, 100), 255)
     draw = ImageDraw.Draw(temp_img)
@@ -29,7 +44,7 @@ def sort_chars(char_list, font, language):
     draw.text((0, 0), char_list, fill=0, font=font)
     cropped_image = ImageOps.invert(out_image).getbbox()
     out_image = out_image.crop(cropped_image)
-    brightness = [np.mean(np.array(out_image)[:, 10 * i:10 * (i + 1)]) for i in range(len(char_list))]
+    brightness = [float(np.mean(np.array(out_image)[:, 10 * i:10 * (i + 1)])) for i in range(len(char_list))]
     char_list = list(char_list)
     zipped_lists = zip(brightness, char_list)
     zipped_lists = sorted(zipped_lists)
@@ -46,68 +61,68 @@ def sort_chars(char_list, font, language):
             break
     if result[-1] != zipped_lists[-1][1]:
         result += zipped_lists[-1][1]
-    return result
+    return result, brightness
 
 
 def get_data(language, mode):
     if language == "general":
         from alphabets import GENERAL as character
-        font = ImageFont.truetype("fonts/DejaVuSansMono-Bold.ttf", size=20)
+        font = get_font("fonts/DejaVuSansMono-Bold.ttf", 20)
         sample_character = "A"
         scale = 2
     elif language == "english":
         from alphabets import ENGLISH as character
-        font = ImageFont.truetype("fonts/DejaVuSansMono-Bold.ttf", size=20)
+        font = get_font("fonts/DejaVuSansMono-Bold.ttf", 20)
         sample_character = "A"
         scale = 2
     elif language == "german":
         from alphabets import GERMAN as character
-        font = ImageFont.truetype("fonts/DejaVuSansMono-Bold.ttf", size=20)
+        font = get_font("fonts/DejaVuSansMono-Bold.ttf", 20)
         sample_character = "A"
         scale = 2
     elif language == "french":
         from alphabets import FRENCH as character
-        font = ImageFont.truetype("fonts/DejaVuSansMono-Bold.ttf", size=20)
+        font = get_font("fonts/DejaVuSansMono-Bold.ttf", 20)
         sample_character = "A"
         scale = 2
     elif language == "italian":
         from alphabets import ITALIAN as character
-        font = ImageFont.truetype("fonts/DejaVuSansMono-Bold.ttf", size=20)
+        font = get_font("fonts/DejaVuSansMono-Bold.ttf", 20)
         sample_character = "A"
         scale = 2
     elif language == "polish":
         from alphabets import POLISH as character
-        font = ImageFont.truetype("fonts/DejaVuSansMono-Bold.ttf", size=20)
+        font = get_font("fonts/DejaVuSansMono-Bold.ttf", 20)
         sample_character = "A"
         scale = 2
     elif language == "portuguese":
         from alphabets import PORTUGUESE as character
-        font = ImageFont.truetype("fonts/DejaVuSansMono-Bold.ttf", size=20)
+        font = get_font("fonts/DejaVuSansMono-Bold.ttf", 20)
         sample_character = "A"
         scale = 2
     elif language == "spanish":
         from alphabets import SPANISH as character
-        font = ImageFont.truetype("fonts/DejaVuSansMono-Bold.ttf", size=20)
+        font = get_font("fonts/DejaVuSansMono-Bold.ttf", 20)
         sample_character = "A"
         scale = 2
     elif language == "russian":
         from alphabets import RUSSIAN as character
-        font = ImageFont.truetype("fonts/DejaVuSansMono-Bold.ttf", size=20)
+        font = get_font("fonts/DejaVuSansMono-Bold.ttf", 20)
         sample_character = "Ш"
         scale = 2
     elif language == "chinese":
         from alphabets import CHINESE as character
-        font = ImageFont.truetype("fonts/simsun.ttc", size=10)
+        font = get_font("fonts/simsun.ttc", 10)
         sample_character = "制"
         scale = 1
     elif language == "korean":
         from alphabets import KOREAN as character
-        font = ImageFont.truetype("fonts/arial-unicode.ttf", size=10)
+        font = get_font("fonts/arial-unicode.ttf", 10)
         sample_character = "ㅊ"
         scale = 1
     elif language == "japanese":
         from alphabets import JAPANESE as character
-        font = ImageFont.truetype("fonts/arial-unicode.ttf", size=10)
+        font = get_font("fonts/arial-unicode.ttf", 10)
         sample_character = "お"
         scale = 1
     else:
@@ -0,0 +1,139 @@
+"""
+把视频（或摄像头）实时播放为终端中的ASCII字符画
+"""
+import argparse
+import shutil
+import sys
+import time
+
+from ansi import CLEAR_SCREEN, CURSOR_HOME, HIDE_CURSOR, RESET, SHOW_CURSOR, build_escape_table, colorize_rows, \
+    quantize
+from ascii_daemon import add_daemon_args, forward
+from cell_stats import cell_bounds, cell_gray, grid_means
+from glyph_lut import add_lut_args, map_cells
+from stage_timer import add_profile_args, count, profiled, stage
+from startup import add_startup_args, lazy_import, startup_profile
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+
+
+def get_args(argv=None):
+    parser = argparse.ArgumentParser("Video to ASCII text")
+    parser.add_argument("--input", type=str, default="data/input.mp4", help="Path to input video or webcam index")
+    parser.add_argument("--mode", type=str, default="complex", choices=["simple", "complex"],
+                        help="10 or 70 different characters")
+    parser.add_argument("--num_cols", type=int, default=0,
+                        help="number of character for output's width (0: fit the terminal)")
+    parser.add_argument("--color", action="store_true", help="Enable 24-bit color output")
+    parser.add_argument("--color_step", type=int, default=8,
+                        help="quantization step per color channel, larger values merge more color runs")
+    parser.add_argument("--fps", type=float, default=0, help="playback frame rate (0: source frame rate)")
+    parser.add_argument("--no_stats", action="store_true", help="Hide the stats line below each frame")
+    add_lut_args(parser)
+    add_profile_args(parser)
+    add_startup_args(parser)
+    add_daemon_args(parser)
+    args = parser.parse_args(argv)
+    return args
+
+
+def open_capture(source):
+    # 纯数字视为摄像头编号
+    if source.isdigit():
+        return cv2.VideoCapture(int(source)), True
+    return cv2.VideoCapture(source), False
+
+
+def main(opt):
+    if opt.mode == "simple":
+        CHAR_LIST = '@%#*+=-:. '
+    else:
+        CHAR_LIST = "$@B%8&WM#*oahkbdpqwmZO0QLCJUYXzcvunxrjft/\|()1{}[]?-_+~<>i!lI;:,\"^`'. "
+    num_chars = len(CHAR_LIST)
+    chars = np.array(list(CHAR_LIST))
+    cap, live = open_capture(opt.input)
+    with stage("decode"):
+        flag, frame = cap.read()
+    if not flag:
+        raise ValueError("Could not read any frame from {}".format(opt.input))
+    fps = opt.fps or cap.get(cv2.CAP_PROP_FPS) or 30
+
+    # 网格只根据第一帧计算一次
+    height, width = frame.shape[:2]
+    terminal_cols, terminal_rows = shutil.get_terminal_size()
+    if opt.num_cols:
+        num_cols = min(opt.num_cols, width)
+    else:
+        # 缩小整帧以适应终端：单元格高为宽的 2 倍，并保留一行给统计信息
+        fit_rows = max(terminal_rows - 1, 1)
+        num_cols = max(min(terminal_cols, width, int(fit_rows * 2 * width / height)), 1)
+    cell_width = width / num_cols
+    cell_height = 2 * cell_width
+    num_rows = max(int(height / cell_height), 1)
+    ys = cell_bounds(height, cell_height, num_rows)
+    xs = cell_bounds(width, cell_width, num_cols)
+    table = build_escape_table(opt.color_step) if opt.color else None
+
+    out = sys.stdout.buffer
+    out.write((CLEAR_SCREEN + HIDE_CURSOR).encode())
+    start = time.perf_counter()
+    shown = dropped = 0
+    index = 0
+    try:
+        while flag:
+            count("cells", num_rows * num_cols)
+            with stage("stats"):
+                if opt.color:
+                    cell_colors = grid_means(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), ys, xs)
+                    cell_grays = cell_gray(cell_colors)
+                else:
+                    cell_grays = grid_means(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), ys, xs)
+            with stage("select"):
+                char_indices = map_cells(cell_grays, num_chars, opt.gamma, opt.skip_darkest)
+            count("glyphs", char_indices.size)
+            with stage("render"):
+                lines = ["".join(row) for row in chars[char_indices].tolist()]
+                if opt.color:
+                    lines = colorize_rows(lines, quantize(cell_colors, opt.color_step), table)
+                data = (CURSOR_HOME + "\n".join(lines) + "\n").encode()
+                if not opt.no_stats:
+                    elapsed = time.perf_counter() - start
+                    data += "{}{:6.1f} fps | {:8d} bytes/frame | {} dropped\033[K".format(
+                        RESET, shown / elapsed if elapsed > 0 else 0.0, len(data), dropped).encode()
+            with stage("encode"):
+                out.write(data)
+                out.flush()
+            count("bytes_written", len(data))
+            count("frames")
+            shown += 1
+            index += 1
+
+            if live:
+                with stage("decode"):
+                    flag, frame = cap.read()
+                continue
+            # 按源帧率播放：提前则等待，落后则跳过（只 grab 不解码）来追赶
+            delay = start + index / fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            while delay < -1 / fps and cap.grab():
+                index += 1
+                dropped += 1
+                delay += 1 / fps
+            with stage("decode"):
+                flag, frame = cap.read()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        out.write((RESET + SHOW_CURSOR + "\n").encode())
+        out.flush()
+        cap.release()
+
+
+if __name__ == '__main__':
+    # 守护进程在运行时由它播放（见 ascii_daemon），否则在本进程中播放
+    forward('video2txt')
+    opt = get_args()
+    with startup_profile(opt), profiled(opt):
+        main(opt)
@@ -3,15 +3,26 @@
 """
 import argparse
 
-import cv2
-import numpy as np
-from PIL import Image, ImageFont, ImageDraw, ImageOps
+from animation import add_animation_args
+from ascii_daemon import add_daemon_args, forward
+from cell_stats import grid_means
+from font_registry import get_font
+from glyph_atlas import get_atlas
+from glyph_lut import add_lut_args, map_cells
+from glyph_match import add_match_args, match_cells
+from stage_timer import add_profile_args, count, profiled, stage
+from startup import add_startup_args, lazy_import, startup_profile
+from video_pipeline import FramePlan, add_pipeline_args, convert_video
 
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
 
-def get_args():
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser("Image to ASCII")
     parser.add_argument("--input", type=str, default="data/input.mp4", help="Path to input video")
-    parser.add_argument("--output", type=str, default="data/output.mp4", help="Path to output video")
+    parser.add_argument("--output", type=str, default="data/output.mp4",
+                        help="Path to output video (.gif, .png or .apng for an animation)")
     parser.add_argument("--mode", type=str, default="simple", choices=["simple", "complex"],
                         help="10 or 70 different characters")
     parser.add_argument("--background", type=str, default="white", choices=["black", "white"],
@@ -20,11 +31,18 @@ def get_args():
     parser.add_argument("--scale", type=int, default=1, help="upsize output")
     parser.add_argument("--fps", type=int, default=0, help="frame per second")
     parser.add_argument("--overlay_ratio", type=float, default=0.2, help="Overlay width ratio")
-    args = parser.parse_args()
+    add_lut_args(parser)
+    add_match_args(parser)
+    add_pipeline_args(parser)
+    add_animation_args(parser)
+    add_profile_args(parser)
+    add_startup_args(parser)
+    add_daemon_args(parser)
+    args = parser.parse_args(argv)
     return args
 
 
-def main(opt):
+def load_resources(opt, first_frame):
     if opt.mode == "simple":
         CHAR_LIST = '@%#*+=-:. '
     else:
@@ -33,64 +51,42 @@ def main(opt):
         bg_code = 255
     else:
         bg_code = 0
-    font = ImageFont.truetype("fonts/DejaVuSansMono-Bold.ttf", size=int(10 * opt.scale))
-    cap = cv2.VideoCapture(opt.input)
-    if opt.fps == 0:
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-    else:
-        fps = opt.fps
+    font = get_font("fonts/DejaVuSansMono-Bold.ttf", int(10 * opt.scale))
+    char_width = font.getbbox("A")[2]
+    char_height = sum(font.getmetrics())
+    plan = FramePlan(opt, first_frame.shape, char_width, char_height)
+    atlas = get_atlas(font, CHAR_LIST, char_width, char_height)
+    return CHAR_LIST, bg_code, plan, atlas
+
+
+def convert_frame(frame, opt, resources):
+    CHAR_LIST, bg_code, plan, atlas = resources
     num_chars = len(CHAR_LIST)
-    num_cols = opt.num_cols
-    while cap.isOpened():
-        flag, frame = cap.read()
-        if flag:
-            image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    count("cells", plan.num_rows * plan.num_cols)
+    with stage("stats"):
+        image = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if opt.match != "structure":
+            cell_grays = grid_means(image, plan.ys, plan.xs)
+    with stage("select"):
+        if opt.match == "structure":
+            char_indices = match_cells(image, plan.ys, plan.xs, atlas, opt.match_grid, opt.gamma, opt.skip_darkest)
         else:
-            break
-        height, width = image.shape
-        cell_width = width / opt.num_cols
-        cell_height = 2 * cell_width
-        num_rows = int(height / cell_height)
-        if num_cols > width or num_rows > height:
-            print("Too many columns or rows. Use default setting")
-            cell_width = 6
-            cell_height = 12
-            num_cols = int(width / cell_width)
-            num_rows = int(height / cell_height)
-        char_width, char_height = font.getsize("A")
-        out_width = char_width * num_cols
-        out_height = 2 * char_height * num_rows
-        out_image = Image.new("L", (out_width, out_height), bg_code)
-        draw = ImageDraw.Draw(out_image)
-        for i in range(num_rows):
-            line = "".join([CHAR_LIST[min(int(np.mean(
-                image[int(i * cell_height):min(int((i + 1) * cell_height), height),
-                int(j * cell_width):min(int((j + 1) * cell_width), width)]) * num_chars / 255), num_chars - 1)] for j in
-                            range(num_cols)]) + "\n"
-            draw.text((0, i * char_height), line, fill=255 - bg_code, font=font)
+            char_indices = map_cells(cell_grays, num_chars, opt.gamma, opt.skip_darkest)
+    count("glyphs", char_indices.size)
+    with stage("render"):
+        out_image = atlas.render(char_indices, bg_code, foreground=255 - bg_code)
+        cv2.cvtColor(out_image, cv2.COLOR_GRAY2BGR, dst=plan.buffer)
+        plan.add_overlay(frame)
+    return plan.buffer
 
-        if opt.background == "white":
-            cropped_image = ImageOps.invert(out_image).getbbox()
-        else:
-            cropped_image = out_image.getbbox()
-        out_image = out_image.crop(cropped_image)
-        out_image = cv2.cvtColor(np.array(out_image), cv2.COLOR_GRAY2BGR)
-        out_image = np.array(out_image)
-        try:
-            out
-        except:
-            out = cv2.VideoWriter(opt.output, cv2.VideoWriter_fourcc(*"XVID"), fps,
-                                  ((out_image.shape[1], out_image.shape[0])))
 
-        if opt.overlay_ratio:
-            height, width, _ = out_image.shape
-            overlay = cv2.resize(frame, (int(width * opt.overlay_ratio), int(height * opt.overlay_ratio)))
-            out_image[height - int(height * opt.overlay_ratio):, width - int(width * opt.overlay_ratio):, :] = overlay
-        out.write(out_image)
-    cap.release()
-    out.release()
+def main(opt):
+    convert_video(opt, load_resources, convert_frame)
 
 
 if __name__ == '__main__':
+    # 守护进程在运行时由它转换（见 ascii_daemon），否则在本进程中转换
+    forward('video2video')
     opt = get_args()
-    main(opt)
+    with startup_profile(opt), profiled(opt):
+        main(opt)
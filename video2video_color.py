@@ -3,15 +3,26 @@
 """
 import argparse
 
-import cv2
-import numpy as np
-from PIL import Image, ImageFont, ImageDraw, ImageOps
+from animation import add_animation_args
+from ascii_daemon import add_daemon_args, forward
+from cell_stats import cell_gray, grid_means
+from font_registry import get_font
+from glyph_atlas import get_atlas
+from glyph_lut import add_lut_args, map_cells
+from palette import add_palette_args, build_palette
+from stage_timer import add_profile_args, count, profiled, stage
+from startup import add_startup_args, lazy_import, startup_profile
+from video_pipeline import FramePlan, add_pipeline_args, convert_video
 
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
 
-def get_args():
+
+def get_args(argv=None):
     parser = argparse.ArgumentParser("Image to ASCII")
     parser.add_argument("--input", type=str, default="data/input.mp4", help="Path to input video")
-    parser.add_argument("--output", type=str, default="data/output.mp4", help="Path to output video")
+    parser.add_argument("--output", type=str, default="data/output.mp4",
+                        help="Path to output video (.gif, .png or .apng for an animation)")
     parser.add_argument("--mode", type=str, default="complex", choices=["simple", "complex"],
                         help="10 or 70 different characters")
     parser.add_argument("--background", type=str, default="black", choices=["black", "white"],
@@ -20,11 +31,22 @@ def get_args():
     parser.add_argument("--scale", type=int, default=1, help="upsize output")
     parser.add_argument("--fps", type=int, default=0, help="frame per second")
     parser.add_argument("--overlay_ratio", type=float, default=0.2, help="Overlay width ratio")
-    args = parser.parse_args()
+    add_lut_args(parser)
+    parser.add_argument("--incremental", action="store_true",
+                        help="only redraw cells whose character or color changed since the previous frame")
+    parser.add_argument("--color_threshold", type=int, default=8,
+                        help="per-channel color change that triggers a redraw in incremental mode")
+    add_palette_args(parser)
+    add_pipeline_args(parser)
+    add_animation_args(parser)
+    add_profile_args(parser)
+    add_startup_args(parser)
+    add_daemon_args(parser)
+    args = parser.parse_args(argv)
     return args
 
 
-def main(opt):
+def load_resources(opt, first_frame):
     if opt.mode == "simple":
         CHAR_LIST = '@%#*+=-:. '
     else:
@@ -33,65 +55,70 @@ def main(opt):
         bg_code = (255, 255, 255)
     else:
         bg_code = (0, 0, 0)
-    font = ImageFont.truetype("fonts/DejaVuSansMono-Bold.ttf", size=int(10 * opt.scale))
-    cap = cv2.VideoCapture(opt.input)
-    if opt.fps == 0:
-        fps = int(cap.get(cv2.CAP_PROP_FPS))
-    else:
-        fps = opt.fps
+    font = get_font("fonts/DejaVuSansMono-Bold.ttf", int(10 * opt.scale))
+    char_width = font.getbbox("A")[2]
+    char_height = sum(font.getmetrics())
+    plan = FramePlan(opt, first_frame.shape, char_width, char_height)
+    atlas = get_atlas(font, CHAR_LIST, char_width, char_height)
+    # 整段视频共用一个调色板（BGR 顺序），自适应调色板根据第一帧的单元格颜色生成
+    palette = build_palette(opt, bg_code, grid_means(first_frame, plan.ys, plan.xs))
+    # 增量模式下保存上一次绘制到输出缓冲区中的字符和颜色；调色板模式下复用索引图缓冲区
+    state = {"indices": None, "colors": None, "frame": 0, "palette_indices": None}
+    if palette is not None:
+        state["palette_indices"] = np.empty(plan.buffer.shape[:2], dtype=np.uint8)
+    return CHAR_LIST, bg_code, plan, atlas, state, palette
+
+
+def convert_frame(frame, opt, resources):
+    CHAR_LIST, bg_code, plan, atlas, state, palette = resources
     num_chars = len(CHAR_LIST)
-    num_cols = opt.num_cols
-    while cap.isOpened():
-        flag, frame = cap.read()
-        if flag:
-            image = frame
+    count("cells", plan.num_rows * plan.num_cols)
+    with stage("stats"):
+        cell_colors = grid_means(frame, plan.ys, plan.xs)
+        cell_grays = cell_gray(cell_colors)
+    with stage("select"):
+        char_indices = map_cells(cell_grays, num_chars, opt.gamma, opt.skip_darkest)
+    cell_colors = cell_colors.astype(np.int32)
+    with stage("render"):
+        if palette is not None:
+            # 调色板模式：先渲染索引图，再查表得到 BGR 帧
+            atlas.render_indexed(char_indices, palette.index(cell_colors), out=state["palette_indices"])
+            palette.lookup(state["palette_indices"], out=plan.buffer)
+            count("glyphs", char_indices.size)
+        elif opt.incremental and state["indices"] is not None:
+            changed = (char_indices != state["indices"]) | \
+                      (np.abs(cell_colors - state["colors"]).max(axis=2) > opt.color_threshold)
+            rows, cols = np.nonzero(changed)
+            atlas.render_cells(plan.buffer, rows, cols, char_indices, bg_code, cell_colors)
+            count("glyphs", len(rows))
+            state["indices"][rows, cols] = char_indices[rows, cols]
+            state["colors"][rows, cols] = cell_colors[rows, cols]
+            print("Frame {}: redrew {:.1%} of cells".format(state["frame"], len(rows) / changed.size))
         else:
-            break
-        height, width, _ = image.shape
-        cell_width = width / opt.num_cols
-        cell_height = 2 * cell_width
-        num_rows = int(height / cell_height)
-        if num_cols > width or num_rows > height:
-            print("Too many columns or rows. Use default setting")
-            cell_width = 6
-            cell_height = 12
-            num_cols = int(width / cell_width)
-            num_rows = int(height / cell_height)
-        char_width, char_height = font.getsize("A")
-        out_width = char_width * num_cols
-        out_height = 2 * char_height * num_rows
-        out_image = Image.new("RGB", (out_width, out_height), bg_code)
-        draw = ImageDraw.Draw(out_image)
-        for i in range(num_rows):
-            for j in range(num_cols):
-                partial_image = image[int(i * cell_height):min(int((i + 1) * cell_height), height),
-                                int(j * cell_width):min(int((j + 1) * cell_width), width), :]
-                partial_avg_color = np.sum(np.sum(partial_image, axis=0), axis=0) / (cell_height * cell_width)
-                partial_avg_color = tuple(partial_avg_color.astype(np.int32).tolist())
-                char = CHAR_LIST[min(int(np.mean(partial_image) * num_chars / 255), num_chars - 1)]
-                draw.text((j * char_width, i * char_height), char, fill=partial_avg_color, font=font)
+            # 帧为 BGR 顺序，颜色直接按 BGR 写入输出缓冲区
+            atlas.render(char_indices, bg_code, colors=cell_colors, out=plan.buffer)
+            count("glyphs", char_indices.size)
+            state["indices"] = char_indices
+            state["colors"] = cell_colors
+        state["frame"] += 1
+        plan.add_overlay(frame)
+    return plan.buffer
 
-        if opt.background == "white":
-            cropped_image = ImageOps.invert(out_image).getbbox()
-        else:
-            cropped_image = out_image.getbbox()
-        out_image = out_image.crop(cropped_image)
-        out_image = np.array(out_image)
-        try:
-            out
-        except:
-            out = cv2.VideoWriter(opt.output, cv2.VideoWriter_fourcc(*"XVID"), fps,
-                                  ((out_image.shape[1], out_image.shape[0])))
 
-        if opt.overlay_ratio:
-            height, width, _ = out_image.shape
-            overlay = cv2.resize(frame, (int(width * opt.overlay_ratio), int(height * opt.overlay_ratio)))
-            out_image[height - int(height * opt.overlay_ratio):, width - int(width * opt.overlay_ratio):, :] = overlay
-        out.write(out_image)
-    cap.release()
-    out.release()
+def main(opt):
+    if opt.incremental and opt.palette != "none":
+        print("Palette mode redraws whole frames, ignoring --incremental")
+        opt.incremental = False
+    if opt.incremental and opt.workers > 0:
+        # 增量模式依赖上一帧的结果，只能按顺序逐帧处理
+        print("Incremental mode converts frames in order, ignoring --workers")
+        opt.workers = 0
+    convert_video(opt, load_resources, convert_frame)
 
 
 if __name__ == '__main__':
+    # 守护进程在运行时由它转换（见 ascii_daemon），否则在本进程中转换
+    forward('video2video_color')
     opt = get_args()
-    main(opt)
+    with startup_profile(opt), profiled(opt):
+        main(opt)
@@ -0,0 +1,292 @@
+"""
+视频转换流水线：解码、逐帧转换、编码
+
+--workers 为 0 时在当前线程中逐帧处理；大于 0 时帧保存在共享内存的帧环（FrameRing）中：
+解码线程把帧直接解码到空闲槽位，进程池乱序转换并把结果写入同一槽位的输出区，
+再经过重排缓冲区按原顺序交给唯一的写入线程，写出后槽位回到空闲队列。
+进程之间只传递帧序号和槽位编号，不复制帧数据。
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from animation import AnimationWriter, is_animation
+from cell_stats import cell_bounds
+from stage_timer import count, stage
+from startup import lazy_import
+
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+
+# 工作进程中的转换函数及其参数，由 _init_worker 设置
+_convert_frame = None
+_opt = None
+_resources = None
+_ring = None
+
+
+def add_pipeline_args(parser):
+    parser.add_argument("--workers", type=int, default=0,
+                        help="number of worker processes converting frames (0: convert in the main thread)")
+    parser.add_argument("--queue_size", type=int, default=16,
+                        help="number of shared frame slots, i.e. decoded frames waiting or in flight")
+    return parser
+
+
+class FramePlan:
+    """
+    根据第一帧的尺寸一次性计算的帧几何信息，之后的每一帧都复用
+
+    包括单元格边界、输出尺寸、缩略图叠加位置以及可复用的 BGR 输出缓冲区。
+    """
+
+    def __init__(self, opt, frame_shape, char_width, char_height):
+        height, width = frame_shape[:2]
+        num_cols = opt.num_cols
+        cell_width = width / opt.num_cols
+        cell_height = 2 * cell_width
+        num_rows = int(height / cell_height)
+        if num_cols > width or num_rows > height:
+            print("Too many columns or rows. Use default setting")
+            cell_width = 6
+            cell_height = 12
+            num_cols = int(width / cell_width)
+            num_rows = int(height / cell_height)
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+        self.ys = cell_bounds(height, cell_height, num_rows)
+        self.xs = cell_bounds(width, cell_width, num_cols)
+        self.char_width = char_width
+        self.char_height = char_height
+        out_width = char_width * num_cols
+        out_height = char_height * num_rows
+        self.buffer = np.empty((out_height, out_width, 3), dtype=np.uint8)
+        if opt.overlay_ratio:
+            self.overlay_size = (int(out_width * opt.overlay_ratio), int(out_height * opt.overlay_ratio))
+        else:
+            self.overlay_size = None
+
+    def add_overlay(self, frame):
+        """把原始帧的缩略图叠加到输出缓冲区的右下角"""
+        if self.overlay_size is None:
+            return
+        overlay_width, overlay_height = self.overlay_size
+        self.buffer[self.buffer.shape[0] - overlay_height:, self.buffer.shape[1] - overlay_width:] = \
+            cv2.resize(frame, self.overlay_size)
+
+
+class FrameRing:
+    """
+    共享内存中的帧环：slots 个槽位，每个槽位保存一帧解码后的输入和对应的输出
+
+    create 在主进程中分配内存，attach 在工作进程中按 spec() 连接到同一块内存。
+    """
+
+    def __init__(self, blocks, slots, frame_shape, out_shape, owner):
+        self._blocks = blocks
+        self.owner = owner
+        self.frames = np.ndarray((slots,) + tuple(frame_shape), dtype=np.uint8, buffer=blocks[0].buf)
+        self.outputs = np.ndarray((slots,) + tuple(out_shape), dtype=np.uint8, buffer=blocks[1].buf)
+        self._spec = ([block.name for block in blocks], slots, tuple(frame_shape), tuple(out_shape))
+
+    @classmethod
+    def create(cls, slots, frame_shape, out_shape):
+        blocks = []
+        try:
+            for shape in (frame_shape, out_shape):
+                blocks.append(shared_memory.SharedMemory(create=True, size=slots * int(np.prod(shape))))
+        except Exception:
+            for block in blocks:
+                block.close()
+                block.unlink()
+            raise
+        return cls(blocks, slots, frame_shape, out_shape, owner=True)
+
+    @classmethod
+    def attach(cls, spec):
+        names, slots, frame_shape, out_shape = spec
+        return cls([shared_memory.SharedMemory(name=name) for name in names], slots, frame_shape, out_shape,
+                   owner=False)
+
+    def spec(self):
+        return self._spec
+
+    def close(self):
+        # 先释放数组对共享内存的引用，否则 SharedMemory.close 会抛出 BufferError
+        self.frames = self.outputs = None
+        for block in self._blocks:
+            block.close()
+            if self.owner:
+                block.unlink()
+
+
+def open_writer(opt, fps, image):
+    """按 opt.output 的扩展名打开写入器：.gif、.png、.apng 为动画（见 animation），其他为 XVID 视频"""
+    if is_animation(opt.output):
+        return AnimationWriter(opt.output, fps, image, opt)
+    return cv2.VideoWriter(opt.output, cv2.VideoWriter_fourcc(*"XVID"), fps, (image.shape[1], image.shape[0]))
+
+
+def _init_worker(load_resources, convert_frame, opt, first_frame, ring_spec):
+    global _convert_frame, _opt, _resources, _ring
+    _convert_frame = convert_frame
+    _opt = opt
+    _resources = load_resources(opt, first_frame)
+    _ring = FrameRing.attach(ring_spec)
+
+
+def _convert(index, slot):
+    np.copyto(_ring.outputs[slot], _convert_frame(_ring.frames[slot], _opt, _resources))
+    return index, slot
+
+
+def _decode(cap, ring, free, frames, state):
+    stop = state["stop"]
+    index = 1
+    try:
+        while cap.isOpened() and not stop.is_set():
+            try:
+                slot = free.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            buffer = ring.frames[slot]
+            flag, frame = cap.read(buffer)
+            if not flag:
+                free.put(slot)
+                break
+            # 帧尺寸与槽位不一致时 OpenCV 会另外分配数组
+            if not np.shares_memory(frame, buffer):
+                if frame.shape != buffer.shape:
+                    raise ValueError("Frame {} has shape {}, expected {}".format(index, frame.shape, buffer.shape))
+                buffer[...] = frame
+            frames.put((index, slot))
+            index += 1
+    except Exception as e:
+        state["error"] = e
+        stop.set()
+    finally:
+        frames.put(None)
+
+
+def _write(results, ring, free, out, state):
+    # 重排缓冲区：按帧序号暂存提前完成的帧的槽位（第 0 帧已由主线程写出）
+    pending = {}
+    next_index = 1
+    try:
+        while True:
+            future = results.get()
+            if future is None:
+                break
+            index, slot = future.result()
+            pending[index] = slot
+            while next_index in pending:
+                slot = pending.pop(next_index)
+                out.write(ring.outputs[slot])
+                free.put(slot)
+                next_index += 1
+            if getattr(out, "done", False):
+                # 动画已达到长度限制，不再解码后面的帧
+                state["stop"].set()
+    except Exception as e:
+        state["error"] = e
+        state["stop"].set()
+        # 等待剩余的转换结束后再返回，之后才能释放共享内存
+        while results.get() is not None:
+            pass
+    finally:
+        state["frames"] = next_index
+
+
+def _run_pipelined(cap, first_frame, fps, load_resources, convert_frame, opt):
+    # 主进程先转换第一帧，得到输出尺寸后再分配帧环
+    first_out = convert_frame(first_frame, opt, load_resources(opt, first_frame))
+    out = open_writer(opt, fps, first_out)
+    out.write(first_out)
+    ring = FrameRing.create(max(opt.queue_size, 1), first_frame.shape, first_out.shape)
+    stop = threading.Event()
+    state = {"error": None, "stop": stop, "frames": 1}
+    free = queue.Queue()
+    for slot in range(max(opt.queue_size, 1)):
+        free.put(slot)
+    frames = queue.Queue()
+    results = queue.Queue()
+    decoder = threading.Thread(target=_decode, args=(cap, ring, free, frames, state), daemon=True)
+    writer = threading.Thread(target=_write, args=(results, ring, free, out, state))
+    try:
+        decoder.start()
+        writer.start()
+        with ProcessPoolExecutor(max_workers=opt.workers, initializer=_init_worker,
+                                 initargs=(load_resources, convert_frame, opt, first_frame,
+                                           ring.spec())) as executor:
+            while True:
+                item = frames.get()
+                if item is None or stop.is_set():
+                    break
+                results.put(executor.submit(_convert, *item))
+        results.put(None)
+        writer.join()
+        stop.set()
+        decoder.join()
+    finally:
+        out.release()
+        ring.close()
+    if state["error"] is not None:
+        raise state["error"]
+    return state["frames"]
+
+
+def _run_serial(cap, first_frame, fps, load_resources, convert_frame, opt):
+    resources = load_resources(opt, first_frame)
+    frame = first_frame
+    out = None
+    num_frames = 0
+    while True:
+        out_image = convert_frame(frame, opt, resources)
+        with stage("encode"):
+            if out is None:
+                out = open_writer(opt, fps, out_image)
+            out.write(out_image)
+        num_frames += 1
+        if getattr(out, "done", False):
+            break
+        with stage("decode"):
+            flag, frame = cap.read()
+        if not flag:
+            break
+    out.release()
+    return num_frames
+
+
+def convert_video(opt, load_resources, convert_frame):
+    """
+    转换 opt.input 中的每一帧并写入 opt.output
+
+    load_resources(opt, first_frame) 根据第一帧返回转换所需的资源（字体、字符集、FramePlan、调色板等），
+    在每个工作进程中以同一帧调用一次，得到相同的资源；convert_frame(frame, opt, resources) 返回转换后的 BGR 帧，
+    返回的数组可以在下一次调用时被复用。阶段计时和单元格、字形计数（stage_timer）只统计逐帧处理
+    （--workers 0）的情况，帧数和写出的字节数总会统计。
+    """
+    cap = cv2.VideoCapture(opt.input)
+    if opt.fps == 0:
+        fps = int(cap.get(cv2.CAP_PROP_FPS))
+    else:
+        fps = opt.fps
+    start = time.perf_counter()
+    with stage("decode"):
+        flag, first_frame = cap.read()
+    if not flag:
+        cap.release()
+        raise ValueError("Could not read any frame from {}".format(opt.input))
+    if opt.workers > 0:
+        num_frames = _run_pipelined(cap, first_frame, fps, load_resources, convert_frame, opt)
+    else:
+        num_frames = _run_serial(cap, first_frame, fps, load_resources, convert_frame, opt)
+    cap.release()
+    elapsed = time.perf_counter() - start
+    count("frames", num_frames)
+    count("bytes_written", os.path.getsize(opt.output))
+    print("Converted {} frames in {:.2f}s ({:.2f} frames/s)".format(
+        num_frames, elapsed, num_frames / elapsed if elapsed > 0 else 0.0))